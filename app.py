@@ -1,650 +1,1013 @@
 import os
 import datetime
 import json
-import csv
-import sqlite3
-import uuid
+import logging
 import shutil
-import pandas as pd
-from io import StringIO
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, send_from_directory
 from flask_cors import CORS
 from dotenv import load_dotenv
-import traceback
 import re
-from werkzeug.utils import secure_filename
-from tempfile import gettempdir
+import base64
+import csv
+import io
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from tempfile import SpooledTemporaryFile, mkdtemp
+from batch_writer import BatchedWriter, amount_cents
+from csv_formats import CsvFile, import_transactions, parse_file
+from metrics import REQUEST_SECONDS, RESPONSE_BYTES, record_import, render as render_metrics, sample_lines
+from migrations import ensure_schema
+from rollups import (EFFECTIVE_CATEGORY_SQL, MONTH_SQL, ROLLUP_DIMENSIONS,
+                     add_to_rollups, clear_rollups, remove_from_rollups)
+from response_cache import choose_encoding, entity_tags, response_cache
+from rules import RULE_COLUMNS, apply_rules, validate_rule
+from serialization import (ROW_LAYOUTS, FastJSONProvider, cursor_objects_array, cursor_rows_array, dumps,
+                           json_object_sql, objects_array, orjson, rows_payload)
+from search import clear_search_index, index_transactions, search_transactions, unindex_transactions
+from database import TRANSACTION_FIELDS, bump_data_version, data_version, get_db, pool
+from import_jobs import ImportJob, QueueFull, import_queue
+from logging_config import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Every route; create_app() registers them on the application
+api = Blueprint('api', __name__)
+
+@api.before_app_request
+def start_timer():
+    g.request_start = time.perf_counter()
 
-app = Flask(__name__, static_folder='frontend/build', static_url_path='')
-# Enable CORS with maximum permissiveness
-CORS(app)
+def _count_streamed_bytes(chunks, labels):
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        RESPONSE_BYTES.inc(labels, sent)
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
 
-@app.after_request
+@api.after_app_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-    response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,PATCH,POST,DELETE,OPTIONS')
+    
+    # Labelled by the route pattern, not the URL, so ids don't create new series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    start = g.get('request_start')
+    if start is not None:
+        REQUEST_SECONDS.observe((request.method, route, str(response.status_code)), time.perf_counter() - start)
+    if response.is_streamed:
+        # Streamed exports are counted as their chunks go out
+        response.response = _count_streamed_bytes(response.response, (request.method, route))
+    else:
+        RESPONSE_BYTES.inc((request.method, route), response.content_length or 0)
     return response
 
-# Initialize SQLite database
-def init_db():
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS transactions (
-        id TEXT PRIMARY KEY,
-        date TEXT,
-        description TEXT,
-        amount REAL,
-        category TEXT,
-        custom_category TEXT,
-        currency TEXT DEFAULT 'USD',
-        account TEXT,
-        memo TEXT
-    )
-    ''')
-    conn.commit()
-    conn.close()
+# Sort keys of the paginated transactions API. NULLs are folded into a
+# comparable value so (sort value, id) keyset comparisons never see NULL.
+# Each expression is indexed together with id by migration 3.
+TRANSACTION_SORT_KEYS = {
+    'date': "IFNULL(date, '')",
+    'amount': 'IFNULL(amount, 0)',
+    'description': "IFNULL(description, '')",
+    'category': EFFECTIVE_CATEGORY_SQL,
+}
 
-def migrate_db_schema():
-    """Check if the database schema needs to be migrated and add any missing columns"""
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
-    
-    # Check what columns exist
-    cursor.execute("PRAGMA table_info(transactions)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    # Add currency column if it doesn't exist
-    if 'currency' not in columns:
-        print("Migrating database: Adding currency column to transactions table")
-        cursor.execute('ALTER TABLE transactions ADD COLUMN currency TEXT DEFAULT "USD"')
-        conn.commit()
-        print("Migration complete: Added currency column")
+# A transaction as the JSON object the API sends, encoded by SQLite.
+# json_object() writes a REAL with 15 significant digits, exact for an amount
+# in whole cents below 10^12, which covers every imported amount; any other
+# float is written by json_real() with the digits dumps() would give it.
+TRANSACTION_OBJECT_SQL = json_object_sql(TRANSACTION_FIELDS, {
+    'amount': 'CASE WHEN amount IS NULL OR (amount = amount_cents / 100.0 '
+              'AND ABS(amount_cents) < 100000000000000) THEN amount ELSE json(json_real(amount)) END',
+})
+
+# Raw request bodies are copied in blocks of this size and spill to disk past UPLOAD_SPOOL_BYTES
+UPLOAD_READ_BYTES = 64 * 1024
+UPLOAD_SPOOL_BYTES = 1024 * 1024
+
+def _spool_request_body(stream):
+    """Copy a raw request body into a spooled temp file using fixed-size reads"""
+    spool = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    shutil.copyfileobj(stream, spool, UPLOAD_READ_BYTES)
+    spool.seek(0)
+    return spool
+
+# How an import treats existing rows: 'merge' only adds rows whose fingerprint
+# is not stored yet, 'replace' clears the table first
+IMPORT_MODES = ('merge', 'replace')
+
+def _request_upload(keep=False):
+    """
+    The CSV sent with an upload request as (filename, binary stream), from a
+    raw text/csv body or the multipart 'file' part. keep=True copies the part
+    so it outlives the request. Raises ValueError with the reason for a 400.
+    """
+    if request.mimetype == 'text/csv':
+        # Raw CSV body, e.g. curl --data-binary @export.csv -H 'Content-Type: text/csv'
+        filename = request.args.get('filename', 'upload.csv')
+        if not filename.lower().endswith('.csv'):
+            raise ValueError('File must be a CSV')
+        return filename, _spool_request_body(request.stream)
     
-    # Add account column if it doesn't exist
-    if 'account' not in columns:
-        print("Migrating database: Adding account column to transactions table")
-        cursor.execute('ALTER TABLE transactions ADD COLUMN account TEXT')
-        conn.commit()
-        print("Migration complete: Added account column")
+    if 'file' not in request.files:
+        raise ValueError('No file part in the request')
+        
+    csv_file = request.files['file']
+    if not csv_file:
+        raise ValueError('No file uploaded')
     
-    # Add memo column if it doesn't exist
-    if 'memo' not in columns:
-        print("Migrating database: Adding memo column to transactions table")
-        cursor.execute('ALTER TABLE transactions ADD COLUMN memo TEXT')
-        conn.commit()
-        print("Migration complete: Added memo column")
+    # Check file extension
+    if not csv_file.filename.lower().endswith('.csv'):
+        raise ValueError('File must be a CSV')
     
-    conn.close()
+    # Werkzeug has already streamed the part into a spooled temp file,
+    # but it is closed when the request ends
+    if keep:
+        return csv_file.filename, _spool_request_body(csv_file.stream)
+    return csv_file.filename, csv_file.stream
 
-init_db()
-migrate_db_schema()  # Call the migration function after init_db
+def _request_import_mode():
+    mode = request.values.get('mode', 'merge').lower()
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"mode must be one of: {', '.join(IMPORT_MODES)}")
+    return mode
 
 # Route to handle CSV upload
-@app.route('/api/upload-csv', methods=['POST'])
+@api.route('/api/upload-csv', methods=['POST'])
 def upload_csv():
+    upload = None
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file part in the request'}), 400
-            
-        csv_file = request.files['file']
-        if not csv_file:
-            return jsonify({'error': 'No file uploaded'}), 400
-
-        # Check file extension
-        if not csv_file.filename.lower().endswith('.csv'):
-            return jsonify({'error': 'File must be a CSV'}), 400
-
-        # Save CSV temporarily to detect format and encoding
-        temp_dir = gettempdir()
-        temp_filepath = os.path.join(temp_dir, secure_filename(csv_file.filename))
-        csv_file.save(temp_filepath)
-        
-        # Show file contents for debugging
         try:
-            with open(temp_filepath, 'r') as f:
-                file_contents = f.read(500)  # Read first 500 chars
-                print(f"File contents (first 500 chars):\n{file_contents}")
-        except Exception as read_err:
-            print(f"Error reading temp file: {str(read_err)}")
-        
-        # Clear existing transactions before adding new ones
-        clear_transactions()
-        
-        # Determine CSV format based on headers
-        csv_format = detect_csv_format(temp_filepath)
+            filename, upload = _request_upload()
+            mode = _request_import_mode()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Process based on detected format
-        if csv_format == 'budget':
-            print("Detected budget format with Outflow/Inflow columns")
-            result = process_budget_format(temp_filepath)
-        else:
-            # Check if this is a sample file with debit/credit format
-            if 'sample_transactions.csv' in csv_file.filename.lower() or ('debit' in file_contents.lower() and 'credit' in file_contents.lower()):
-                print("Detected sample transactions format with debit/credit columns")
-                rows_processed = process_sample_transactions_csv(temp_filepath)
-                result = {'message': f'Successfully processed {rows_processed} rows'}
-            else:
-                # Use the original account activity format processor
-                print("Using default CSV format processor")
-                rows_processed = process_account_activity_csv(temp_filepath)
-                result = {'message': f'Successfully processed {rows_processed} rows'}
-        
-        # Clean up temp file
-        if os.path.exists(temp_filepath):
-            os.remove(temp_filepath)
-            
+        result = import_csv(upload, filename, mode)
         return jsonify(result), 200
     except Exception as e:
-        print(f"Error processing uploaded file: {str(e)}")
-        traceback.print_exc()
-        
-        # Clean up
-        if 'temp_filepath' in locals() and os.path.exists(temp_filepath):
-            os.remove(temp_filepath)
-            
+        logger.exception("Error processing uploaded file")
         return jsonify({'error': f'Error processing file: {str(e)}'}), 500
+    finally:
+        if upload is not None:
+            upload.close()
+
+def import_csv(upload, filename, mode='merge', progress=None):
+    """
+    Import one uploaded CSV in whichever registered format it matches.
+    Returns the response dict, with the format used under 'processor'.
+    """
+    logger.info("Importing %s", filename, extra={'mode': mode})
+    
+    # Merge imports skip rows already stored and keep earlier edits
+    if mode == 'replace':
+        clear_transactions()
+    
+    result = _import_file(upload, progress=progress)
+    response = _result_message(result)
+    response['processor'] = result['format']
+    return response
+
+def _import_file(source, fmt=None, progress=None):
+    """Run one CSV through the format registry (csv_formats.py) on a pooled connection"""
+    conn = get_db()
+    try:
+        return import_transactions(conn, source, fmt, progress=progress)
+    finally:
+        conn.close()
+
+def _result_message(result):
+    """The upload response for an import_transactions() result"""
+    # Rows an earlier import already stored were not written again
+    duplicates = result['duplicates']
+    skipped_note = f', skipped {duplicates} already imported' if duplicates else ''
+    
+    if result['errors']:
+        return {
+            'message': f"Processed {result['rows']} rows with {len(result['errors'])} errors{skipped_note}",
+            'errors': result['errors'],
+            'duplicates': duplicates
+        }
+    
+    return {'message': f"Successfully processed {result['rows']} rows{skipped_note}", 'duplicates': duplicates}
 
 def clear_transactions():
     """Clear all transactions from the database"""
-    print("Clearing all existing transactions from database")
-    conn = sqlite3.connect('finance.db')
+    logger.info("Clearing all existing transactions from database")
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('DELETE FROM transactions')
+    clear_rollups(conn)
+    clear_search_index(conn)
+    bump_data_version(conn)
     conn.commit()
     conn.close()
-    print("Transactions table cleared")
+    logger.info("Transactions table cleared")
 
-def process_example_file():
+def process_example_file(mode='merge'):
     """Process the example sample_transactions.csv file"""
     example_file_path = os.path.join(os.getcwd(), 'sample_transactions.csv')
     
     if not os.path.exists(example_file_path):
-        print(f"Example file not found at {example_file_path}")
+        logger.warning("Example file not found at %s", example_file_path)
         return jsonify({'error': 'Example file not found'}), 404
     
     try:
-        # Clear existing transactions before adding new ones
-        clear_transactions()
+        if mode == 'replace':
+            clear_transactions()
         
         rows_processed = process_sample_transactions_csv(example_file_path)
-        print(f"Successfully processed {rows_processed} rows from example file")
+        logger.info("Successfully processed %d rows from example file", rows_processed)
         return jsonify({'message': f'Successfully processed {rows_processed} rows'}), 200
     except Exception as e:
-        print(f"Error processing example file: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error processing example file")
         return jsonify({'error': f'Error processing file: {str(e)}'}), 500
 
-def detect_csv_format(filepath):
+def detect_csv_format(source):
     """
-    Detect the format of the CSV file based on headers
-    Returns 'budget' if it matches the budget format, 'default' otherwise
+    Name of the registered CSV format the file matches, e.g. 'budget' for
+    Outflow/Inflow columns; see csv_formats.py for the layouts
     """
-    try:
-        with open(filepath, 'r', newline='', encoding='utf-8-sig') as file:
-            reader = csv.reader(file)
-            headers = next(reader, None)
-            
-            if headers and 'Outflow' in headers and 'Inflow' in headers:
-                return 'budget'
-            return 'default'
-    except Exception as e:
-        print(f"Error detecting CSV format: {str(e)}")
-        return 'default'
+    with CsvFile(source) as csv_file:
+        return csv_file.format.name
 
-def process_budget_format(filepath):
+def process_budget_format(filepath, progress=None):
     """
     Process CSV file in budget format (with Outflow/Inflow columns)
     """
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
-    
-    processed_rows = 0
-    errors = []
-    
     try:
-        with open(filepath, 'r', newline='', encoding='utf-8-sig') as file:
-            # Use DictReader to access columns by name
-            reader = csv.DictReader(file)
-            
-            for row in reader:
-                try:
-                    # Get values from columns, using empty string if missing
-                    date = row.get('Date', '')
-                    description = row.get('Payee', '')
-                    
-                    # Get account, memo
-                    account = row.get('Account', '')
-                    memo = row.get('Memo', '')
-                    
-                    # Get category
-                    category = row.get('Category', '')
-                    
-                    # Parse amount from Outflow/Inflow
-                    outflow = row.get('Outflow', '0').strip()
-                    inflow = row.get('Inflow', '0').strip()
-                    
-                    # Convert to float, handling empty strings and currency symbols
-                    outflow_amount = float(re.sub(r'[^0-9.-]', '', outflow or '0') or 0)
-                    inflow_amount = float(re.sub(r'[^0-9.-]', '', inflow or '0') or 0)
-                    
-                    # Apply the conversion logic - outflow positive, inflow negative
-                    amount = outflow_amount - inflow_amount
-                    
-                    # Generate a unique ID using date and description
-                    transaction_id = str(uuid.uuid4())
-                    
-                    # Insert into database
-                    cursor.execute(
-                        'INSERT INTO transactions (id, date, description, amount, category, currency, account, memo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                        (transaction_id, date, description, amount, category, 'USD', account, memo)
-                    )
-                    processed_rows += 1
-                    
-                except Exception as e:
-                    errors.append(f"Error on row: {str(e)}")
-                    continue
-                
-            conn.commit()
-            
+        result = _import_file(filepath, 'budget', progress)
     except Exception as e:
-        conn.close()
         return {'error': str(e)}
-    
-    conn.close()
-    
-    if errors:
-        return {
-            'message': f'Processed {processed_rows} rows with {len(errors)} errors',
-            'errors': errors
-        }
-    
-    return {'message': f'Successfully processed {processed_rows} rows'}
+    return _result_message(result)
 
 def process_default_format(filepath):
     """Process CSV file in the default format"""
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
+    try:
+        result = _import_file(filepath, 'account_activity')
+    except Exception as e:
+        return {'error': str(e)}
+    return _result_message(result)
+
+def process_sample_transactions_csv(file_path, progress=None):
+    """Process a sample_transactions.csv format with debit/credit columns"""
+    logger.info("Processing sample transactions CSV: %s", file_path)
+    return _import_file(file_path, 'debit_credit', progress)['rows']
+
+def process_account_activity_csv(file_path, progress=None):
+    """Custom function to process accountactivity.csv format"""
+    logger.info("Processing account activity CSV: %s", file_path)
+    return _import_file(file_path, 'account_activity', progress)['rows']
+
+# Parse processes used by the batch upload. They are spawned rather than
+# forked so they never inherit the pool's open SQLite connections.
+BATCH_PARSE_WORKERS = int(os.environ.get('BATCH_PARSE_WORKERS', str(os.cpu_count() or 2)))
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def _get_parse_pool():
+    """The batch upload's process pool, started on first use and then kept warm"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=BATCH_PARSE_WORKERS,
+                                              mp_context=multiprocessing.get_context('spawn'))
+        return _parse_pool
+
+def _reset_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+def _submit_parse_jobs(files):
+    """Submit parse_file for every (path, filename); futures map to their file"""
+    try:
+        executor = _get_parse_pool()
+        return {executor.submit(parse_file, path, filename): (path, filename) for path, filename in files}
+    except BrokenProcessPool:
+        # A worker died during an earlier batch; start a fresh pool and submit once more
+        _reset_parse_pool()
+        executor = _get_parse_pool()
+        return {executor.submit(parse_file, path, filename): (path, filename) for path, filename in files}
+
+def _parsed_files(files, parallel):
+    """Yield parse_file results as they finish, or an error dict for a file that failed"""
+    if not parallel:
+        for path, filename in files:
+            try:
+                yield parse_file(path, filename)
+            except Exception as e:
+                logger.exception("Error parsing %s", filename)
+                yield {'filename': filename, 'error': str(e)}
+        return
     
-    processed_rows = 0
-    errors = []
+    futures = _submit_parse_jobs(files)
+    broken = []
+    for future in as_completed(futures):
+        path, filename = futures[future]
+        try:
+            yield future.result()
+        except BrokenProcessPool:
+            broken.append((path, filename))
+        except Exception as e:
+            logger.error("Error parsing %s: %s", filename, e)
+            yield {'filename': filename, 'error': str(e)}
+    if not broken:
+        return
     
+    # A worker died and took the files still queued with it: parse those once
+    # more in a fresh pool
+    logger.warning("Parse pool broke, retrying %d files", len(broken))
+    _reset_parse_pool()
+    futures = _submit_parse_jobs(broken)
+    for future in as_completed(futures):
+        path, filename = futures[future]
+        try:
+            yield future.result()
+        except Exception as e:
+            logger.error("Error parsing %s: %s", filename, e)
+            yield {'filename': filename, 'error': str(e)}
+
+def import_csv_files(files):
+    """
+    Import many (path, filename) CSVs: files are parsed in parallel in the
+    process pool and written one after another through a single connection
+    as they finish. Each file is deduplicated against everything stored
+    before it, including the files of the same batch written earlier.
+    """
+    start = time.perf_counter()
+    parallel = len(files) > 1 and BATCH_PARSE_WORKERS > 1
+    reports = []
+    # The one-file-at-a-time baseline: each file's parse CPU time, measured
+    # in its worker, plus its write time; writes are serial either way
+    serial_seconds = 0.0
+    
+    conn = get_db()
     try:
-        with open(filepath, 'r', newline='', encoding='utf-8-sig') as file:
-            reader = csv.reader(file)
-            rows = list(reader)
-            
-            # Skip header row if it exists based on content
-            start_idx = 0
-            if len(rows) > 0 and len(rows[0]) > 0 and isinstance(rows[0][0], str) and (
-                'date' in rows[0][0].lower() or 
-                'time' in rows[0][0].lower() or
-                (len(rows[0]) > 1 and isinstance(rows[0][1], str) and 'description' in rows[0][1].lower())):
-                print("Skipping header row")
-                start_idx = 1
+        for parsed in _parsed_files(files, parallel):
+            if 'error' in parsed:
+                reports.append(parsed)
+                continue
             
-            # Process the rows
-            for row in rows[start_idx:]:
-                try:
-                    print(f"Processing row: {row}")
-                    if len(row) < 3:
-                        print(f"Skipping row (not enough columns): {row}")
-                        continue
-                    
-                    # Create a transaction ID
-                    transaction_id = str(uuid.uuid4())
-                    
-                    # Get date and description
-                    date = row[0].strip()
-                    description = row[1].strip()
-                    
-                    # First try column 2 (debit/outgoing)
-                    amount = None
-                    if len(row) > 2 and row[2].strip():
-                        try:
-                            amount_str = row[2].strip().replace(',', '')
-                            amount = -1 * float(amount_str)  # Negative for debits
-                            print(f"Found debit amount: {amount}")
-                        except ValueError as e:
-                            print(f"Invalid debit amount '{row[2]}': {e}")
-                    
-                    # If no amount in column 2, try column 3 (credit/incoming)
-                    if amount is None and len(row) > 3 and row[3].strip():
-                        try:
-                            amount_str = row[3].strip().replace(',', '')
-                            amount = float(amount_str)  # Positive for credits
-                            print(f"Found credit amount: {amount}")
-                        except ValueError as e:
-                            print(f"Invalid credit amount '{row[3]}': {e}")
-                    
-                    # If neither debit nor credit, skip
-                    if amount is None:
-                        print(f"Skipping row, no valid amount: {row}")
-                        continue
-                    
-                    print(f"Processing transaction: {date}, {description}, ${amount}")
-                    
-                    # Insert into database
-                    cursor.execute(
-                        'INSERT INTO transactions (id, date, description, amount, category, currency, account, memo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                        (transaction_id, date, description, amount, '', 'USD', '', '')
-                    )
-                    processed_rows += 1
-                    
-                except Exception as e:
-                    errors.append(f"Error on row: {str(e)}")
-                    continue
-                
-            conn.commit()
-            
-    except Exception as e:
+            with BatchedWriter(conn, label=f"batch {parsed['filename']}") as writer:
+                writer.add_many(parsed['rows'])
+            record_import(parsed['processor'], len(parsed['rows']), writer.rows_written,
+                          parsed['parse_seconds'] + writer.write_seconds)
+            serial_seconds += parsed['parse_cpu_seconds'] + writer.write_seconds
+            reports.append({
+                'filename': parsed['filename'],
+                'processor': parsed['processor'],
+                'rows': writer.rows_written,
+                'duplicates': writer.rows_skipped,
+                'errors': parsed['errors'],
+                'parse_seconds': round(parsed['parse_seconds'], 3),
+                'write_seconds': round(writer.write_seconds, 3),
+            })
+    finally:
         conn.close()
-        return {'error': str(e)}
-    
-    conn.close()
     
-    if errors:
-        return {
-            'message': f'Processed {processed_rows} rows with {len(errors)} errors',
-            'errors': errors
-        }
+    wall_seconds = time.perf_counter() - start
+    rows = sum(report.get('rows', 0) for report in reports)
+    duplicates = sum(report.get('duplicates', 0) for report in reports)
+    failed = sum(1 for report in reports if 'error' in report)
     
-    return {'message': f'Successfully processed {processed_rows} rows'}
+    logger.info("Batch import of %d files: %d rows", len(files), rows, extra={
+        'seconds': round(wall_seconds, 3),
+        'serial_seconds': round(serial_seconds, 3),
+        'duplicates': duplicates,
+        'failed': failed,
+    })
+    message = f'Successfully processed {rows} rows from {len(files) - failed} files'
+    if duplicates:
+        message += f', skipped {duplicates} already imported'
+    if failed:
+        message += f', {failed} files failed'
+    return {
+        'message': message,
+        'files': reports,
+        'rows': rows,
+        'duplicates': duplicates,
+        'workers': BATCH_PARSE_WORKERS if parallel else 1,
+        'wall_seconds': round(wall_seconds, 3),
+        'serial_seconds': round(serial_seconds, 3),
+        'speedup': round(serial_seconds / wall_seconds, 2) if wall_seconds > 0 else None,
+    }
 
-def process_sample_transactions_csv(file_path):
-    """Process a sample_transactions.csv format with debit/credit columns"""
-    print(f"Processing sample transactions CSV: {file_path}")
+# Route to upload many CSVs at once, e.g. one export per account per month
+@api.route('/api/upload-csv/batch', methods=['POST'])
+def upload_csv_batch():
+    uploads = [upload for upload in request.files.getlist('files') + request.files.getlist('file') if upload]
+    if not uploads:
+        return jsonify({'error': 'No files uploaded'}), 400
     
-    # Connect to database
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
+    for upload in uploads:
+        if not upload.filename.lower().endswith('.csv'):
+            return jsonify({'error': f'File must be a CSV: {upload.filename}'}), 400
     
-    processed_rows = 0
+    mode = request.values.get('mode', 'merge').lower()
+    if mode not in IMPORT_MODES:
+        return jsonify({'error': f"mode must be one of: {', '.join(IMPORT_MODES)}"}), 400
     
+    # The parse workers open the files by path
+    workdir = mkdtemp(prefix='budget-batch-')
     try:
-        # Read the CSV file with header row
-        df = pd.read_csv(file_path)
-        print(f"Read CSV with pandas. Columns: {df.columns.tolist()}")
-        print(f"Sample data:\n{df.head()}")
+        files = []
+        for index, upload in enumerate(uploads):
+            path = os.path.join(workdir, f'{index}.csv')
+            upload.save(path)
+            files.append((path, upload.filename))
         
-        # Process each row
-        for index, row in df.iterrows():
-            try:
-                # Create a transaction ID
-                transaction_id = str(uuid.uuid4())
-                
-                # Get date and description
-                date = row['date']
-                description = row['description']
-                
-                # Calculate amount from debit/credit columns
-                amount = None
-                
-                # Check if debit column exists and has a value
-                if 'debit' in df.columns and pd.notna(row['debit']):
-                    amount = -1 * float(row['debit'])  # Negative for debits
-                    print(f"Found debit amount: {amount}")
-                
-                # If no debit amount, check for credit column
-                if amount is None and 'credit' in df.columns and pd.notna(row['credit']):
-                    amount = float(row['credit'])  # Positive for credits
-                    print(f"Found credit amount: {amount}")
-                
-                # If neither debit nor credit, skip
-                if amount is None:
-                    print(f"Skipping row, no valid amount: {row}")
-                    continue
-                
-                print(f"Processing transaction: {date}, {description}, ${amount}")
-                
-                # Insert into database
-                cursor.execute(
-                    'INSERT INTO transactions (id, date, description, amount, category, currency, account, memo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                    (transaction_id, date, description, amount, '', 'USD', '', '')
-                )
-                processed_rows += 1
-                
-            except Exception as e:
-                print(f"Error processing row {row}: {str(e)}")
-                traceback.print_exc()
-        
-        # Commit the changes
-        conn.commit()
-        print(f"Processed {processed_rows} rows")
+        if mode == 'replace':
+            clear_transactions()
         
+        return jsonify(import_csv_files(files)), 200
     except Exception as e:
-        print(f"Error processing CSV: {str(e)}")
-        traceback.print_exc()
-        raise
+        logger.exception("Error processing batch upload")
+        return jsonify({'error': f'Error processing files: {str(e)}'}), 500
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _run_import_job(job):
+    """Worker-thread body of a background import"""
+    job.start()
+    logger.info("Import job %s started: %s", job.id, job.filename, extra={'bytes': job.bytes_total})
+    try:
+        result = import_csv(job.source, job.filename, job.mode, progress=job.progress)
+        job.processor = result.get('processor')
+        job.add_errors(result.get('errors', []))
+        if 'error' in result:
+            job.finish(error=result['error'])
+        else:
+            job.finish(message=result['message'])
+    except Exception as e:
+        logger.exception("Import job %s failed", job.id)
+        job.finish(error=str(e))
+    finally:
+        job.source.close()
+    logger.info("Import job %s %s", job.id, job.status, extra={'rows': job.rows, 'duplicates': job.duplicates})
+
+# Route to start a background import; poll the returned status_url for progress
+@api.route('/api/imports', methods=['POST'])
+def create_import():
+    upload = None
+    try:
+        try:
+            filename, upload = _request_upload(keep=True)
+            mode = _request_import_mode()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
+        upload.seek(0, os.SEEK_END)
+        bytes_total = upload.tell()
+        upload.seek(0)
+        
+        job = import_queue.submit(ImportJob(filename, mode, upload, bytes_total), _run_import_job)
+        upload = None  # the job owns it now
+        
+        response = jsonify(dict(job.snapshot(), status_url=f'/api/imports/{job.id}'))
+        response.headers['Location'] = f'/api/imports/{job.id}'
+        return response, 202
+    except QueueFull as e:
+        return jsonify({'error': f'Import queue is full: {str(e)}'}), 503
+    except Exception as e:
+        logger.exception("Error queueing import")
+        return jsonify({'error': f'Error queueing import: {str(e)}'}), 500
     finally:
-        conn.close()
+        if upload is not None:
+            upload.close()
+
+# Route to list recent background imports, newest first
+@api.route('/api/imports', methods=['GET'])
+def list_imports():
+    return jsonify([job.snapshot() for job in reversed(import_queue.jobs())])
+
+# Route to poll one background import
+@api.route('/api/imports/<job_id>', methods=['GET'])
+def get_import(job_id):
+    job = import_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Import not found'}), 404
+    return jsonify(job.snapshot())
+
+# Query parameters of the paginated transactions API
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+DEFAULT_SEARCH_LIMIT = 20
+EXPORT_FORMATS = ('json', 'ndjson', 'csv')
+# Rows read from the cursor and encoded per chunk of a streamed export
+STREAM_BATCH_ROWS = 1000
+TEXT_FILTER_COLUMNS = ('date', 'description', 'currency', 'account', 'memo')
+PAGINATION_PARAMS = ('limit', 'cursor', 'sort', 'direction', 'search', 'category', 'merchant', 'amount',
+                     'date_from', 'date_to', 'include_total') + TEXT_FILTER_COLUMNS
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+def _escape_like(value):
+    """Escape LIKE wildcards so user input matches literally"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def encode_cursor(sort, direction, sort_value, transaction_id):
+    payload = json.dumps([sort, direction, sort_value, transaction_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort, direction):
+    """Return (sort value, id) from a cursor issued for the same sort and direction"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        cursor_sort, cursor_direction, sort_value, transaction_id = payload
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort or cursor_direction != direction:
+        raise ValueError('Cursor does not match the requested sort')
+    return sort_value, transaction_id
+
+def build_transaction_filters(args):
+    """
+    Translate the list view's filters into SQL conditions.
+    search matches the description, category is an exact match on the
+    effective category ('Uncategorized' for none), merchant is an exact match
+    on the canonical merchant, amount accepts '>x', '<x' or an exact value,
+    date_from and date_to bound the date (YYYY-MM-DD, inclusive), and the
+    remaining text columns are substring matches.
+    """
+    clauses = []
+    params = []
     
-    return processed_rows
+    search = args.get('search', '')
+    if search:
+        clauses.append("description LIKE ? ESCAPE '\\'")
+        params.append(f'%{_escape_like(search)}%')
+    
+    category = args.get('category', '')
+    if category:
+        clauses.append(f'{EFFECTIVE_CATEGORY_SQL} = ?')
+        params.append('' if category == 'Uncategorized' else category)
+    
+    merchant = args.get('merchant', '')
+    if merchant:
+        clauses.append('merchant = ?')
+        params.append(merchant)
+    
+    amount = args.get('amount', '').strip()
+    if amount:
+        operator = '='
+        if amount[0] in '<>':
+            operator, amount = amount[0], amount[1:]
+        try:
+            value = float(amount)
+        except ValueError:
+            raise ValueError(f"Invalid amount filter '{args.get('amount')}'")
+        # Compared in cents, so 4.10 matches exactly
+        clauses.append(f'amount_cents {operator} ?')
+        params.append(amount_cents(value))
+    
+    # Dates are stored as ISO text. The bounds are written on the date sort
+    # key, so idx_transactions_date_id serves both the range and the keyset
+    # order. A missing date sorts as '', which date_to alone must not match.
+    date_key = TRANSACTION_SORT_KEYS['date']
+    for arg in ('date_from', 'date_to'):
+        value = args.get(arg, '')
+        if value and not DATE_PATTERN.match(value):
+            raise ValueError(f"{arg} must be a date like 2025-01-31")
+    if args.get('date_from'):
+        clauses.append(f'{date_key} >= ?')
+        params.append(args['date_from'])
+    elif args.get('date_to'):
+        clauses.append(f"{date_key} > ''")
+    if args.get('date_to'):
+        clauses.append(f'{date_key} <= ?')
+        params.append(args['date_to'])
+    
+    for column in TEXT_FILTER_COLUMNS:
+        value = args.get(column, '')
+        if value:
+            clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+            params.append(f'%{_escape_like(value)}%')
+    
+    return clauses, params
 
-def process_account_activity_csv(file_path):
-    """Custom function to process accountactivity.csv format"""
-    print(f"Processing account activity CSV: {file_path}")
+def _sort_and_direction(args):
+    sort = args.get('sort', 'date')
+    if sort not in TRANSACTION_SORT_KEYS:
+        raise ValueError(f"Cannot sort by '{sort}'")
+    direction = args.get('direction', 'desc').lower()
+    if direction not in ('asc', 'desc'):
+        raise ValueError("direction must be 'asc' or 'desc'")
+    return sort, direction
+
+def query_transactions_page(args):
+    """Run one keyset-paginated page query for the given request arguments"""
+    sort, direction = _sort_and_direction(args)
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
     
-    # Connect to database
-    conn = sqlite3.connect('finance.db')
+    filter_clauses, filter_params = build_transaction_filters(args)
+    clauses, params = list(filter_clauses), list(filter_params)
+    
+    sort_key = TRANSACTION_SORT_KEYS[sort]
+    comparison = '<' if direction == 'desc' else '>'
+    cursor_arg = args.get('cursor')
+    if cursor_arg:
+        sort_value, transaction_id = decode_cursor(cursor_arg, sort, direction)
+        # The single-column bound lets SQLite range-scan the expression index;
+        # the row value comparison then breaks ties on id
+        clauses.append(f'{sort_key} {comparison}= ? AND ({sort_key}, id) {comparison} (?, ?)')
+        params.extend([sort_value, sort_value, transaction_id])
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    order = direction.upper()
+    
+    layout = _row_layout(args)
+    row_sql = TRANSACTION_OBJECT_SQL if layout == 'objects' else TRANSACTION_FIELDS
+    
+    conn = get_db()
     cursor = conn.cursor()
     
-    processed_rows = 0
+    cursor.execute(
+        f'SELECT {sort_key}, id, {row_sql} FROM transactions {where} '
+        f'ORDER BY {sort_key} {order}, id {order} LIMIT ?',
+        params + [limit + 1]
+    )
+    columns = [column[0] for column in cursor.description][2:]
+    rows = cursor.fetchall()
+    
+    total = None
+    if args.get('include_total', '').lower() in ('1', 'true', 'yes'):
+        filter_where = f"WHERE {' AND '.join(filter_clauses)}" if filter_clauses else ''
+        cursor.execute(f'SELECT COUNT(*) FROM transactions {filter_where}', filter_params)
+        total = cursor.fetchone()[0]
+    
+    conn.close()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, direction, last[0], last[1])
+    
+    # The leading sort value and id only build the cursor
+    if layout == 'objects':
+        transactions = objects_array(row[2] for row in rows)
+    else:
+        transactions = rows_payload(columns, [row[2:] for row in rows])
+    page = {
+        'transactions': transactions,
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+    }
+    if total is not None:
+        page['total'] = total
+    return page
+
+def _row_layout(args):
+    layout = args.get('layout', 'objects')
+    if layout not in ROW_LAYOUTS:
+        raise ValueError(f"layout must be one of: {', '.join(ROW_LAYOUTS)}")
+    return layout
+
+def query_all_transactions(args):
+    layout = _row_layout(args)
+    
+    order = f"ORDER BY {TRANSACTION_SORT_KEYS['date']} DESC, id DESC"
+    
+    conn = get_db()
     try:
-        # Try using pandas to read the file first, as it's more robust
+        if layout == 'objects':
+            # SQLite encodes each row's object; they are joined batch by batch
+            # without a dict per row or one encode of the whole list
+            return cursor_objects_array(conn.execute(f'SELECT {TRANSACTION_OBJECT_SQL} FROM transactions {order}'))
+        # Plain tuples: building sqlite3.Row objects and dicts from them cost more than the query
+        cursor = conn.execute(f'SELECT {TRANSACTION_FIELDS} FROM transactions {order}')
+        columns = [column[0] for column in cursor.description]
+        return rows_payload(columns, cursor_rows_array(cursor))
+    finally:
+        conn.close()
+
+def stream_transactions(args, export_format):
+    """
+    Every transaction matching the list view's filters, in the requested
+    sort, as a streamed NDJSON or CSV response. Rows are read from the
+    cursor STREAM_BATCH_ROWS at a time and sent as they are encoded, so
+    memory use does not grow with the number of rows.
+    """
+    sort, direction = _sort_and_direction(args)
+    clauses, params = build_transaction_filters(args)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    order = direction.upper()
+    sort_key = TRANSACTION_SORT_KEYS[sort]
+    
+    conn = get_db()
+    try:
+        cursor = conn.execute(
+            f'SELECT {TRANSACTION_FIELDS} FROM transactions {where} ORDER BY {sort_key} {order}, id {order}',
+            params)
+    except Exception:
+        conn.close()
+        raise
+    columns = [column[0] for column in cursor.description]
+    
+    def generate():
+        # The connection goes back to the pool when the response is closed,
+        # including when the client disconnects part way through
         try:
-            print("Attempting to read CSV with pandas")
-            df = pd.read_csv(file_path, header=None)
-            print(f"CSV read with pandas, shape: {df.shape}")
-            
-            # Skip header row if it exists based on content
-            if df.shape[0] > 0 and isinstance(df.iloc[0, 0], str) and (
-                'date' in df.iloc[0, 0].lower() or 
-                'time' in df.iloc[0, 0].lower() or
-                'description' in str(df.iloc[0, 1]).lower()):
-                print("Skipping header row")
-                df = df.iloc[1:]
-            
-            # Process each row
-            for _, row in df.iterrows():
-                try:
-                    # Create a transaction ID
-                    transaction_id = str(uuid.uuid4())
-                    
-                    # Date is always in column 0
-                    date = str(row[0]).strip('"').strip()
-                    
-                    # Description is always in column 1
-                    description = str(row[1]).strip('"').strip()
-                    
-                    # Amount could be in column 2 (debit) or column 3 (credit)
-                    amount = None
-                    
-                    # Check for debit amount (negative)
-                    if pd.notna(row[2]) and str(row[2]).strip():
-                        try:
-                            amount_str = str(row[2]).strip('"').strip().replace(',', '')
-                            amount = -1 * float(amount_str)  # Negative for debits
-                            print(f"Found debit amount: {amount}")
-                        except ValueError as e:
-                            print(f"Invalid debit amount '{row[2]}': {e}")
-                    
-                    # If no debit amount, check for credit amount (positive)
-                    if amount is None and len(row) > 3 and pd.notna(row[3]) and str(row[3]).strip():
-                        try:
-                            amount_str = str(row[3]).strip('"').strip().replace(',', '')
-                            amount = float(amount_str)  # Positive for credits
-                            print(f"Found credit amount: {amount}")
-                        except ValueError as e:
-                            print(f"Invalid credit amount '{row[3]}': {e}")
-                    
-                    # If neither debit nor credit, skip
-                    if amount is None:
-                        print(f"Skipping row, no valid amount: {row}")
-                        continue
-                    
-                    print(f"Processing transaction: {date}, {description}, ${amount}")
-                    
-                    # Insert into database
-                    cursor.execute(
-                        'INSERT INTO transactions (id, date, description, amount, category, currency, account, memo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                        (transaction_id, date, description, amount, '', 'USD', '', '')
-                    )
-                    processed_rows += 1
-                    
-                except Exception as e:
-                    print(f"Error processing row {row}: {str(e)}")
-                    traceback.print_exc()
-            
-            # Commit the changes
-            conn.commit()
-            print(f"Processed {processed_rows} rows using pandas")
-            return processed_rows
-            
-        except Exception as pandas_error:
-            print(f"Failed to use pandas: {str(pandas_error)}")
-            traceback.print_exc()
-            
-            # If pandas failed, reset counter and try the CSV module
-            processed_rows = 0
-            print("Falling back to CSV module...")
-        
-        # Read the CSV file with proper newline support
-        with open(file_path, 'r', newline='', encoding='utf-8') as f:
-            # First, let's examine the file structure
-            file_sample = f.read(1000)  # Read a sample to examine
-            print(f"File sample (first 1000 chars):\n{file_sample}")
-            f.seek(0)  # Reset file pointer to beginning
-            
-            # Try to detect the delimiter
-            dialect = csv.Sniffer().sniff(file_sample, delimiters=',;"\t')
-            print(f"Detected CSV dialect: delimiter='{dialect.delimiter}', quotechar='{dialect.quotechar}'")
-            
-            # Try different quote settings if standard reading fails
-            try:
-                reader = csv.reader(f, quoting=csv.QUOTE_ALL)
-                rows = list(reader)  # Convert to list to check if rows were read
-                print(f"Read {len(rows)} rows with QUOTE_ALL")
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if export_format == 'csv':
+                writer.writerow(columns)
+            while True:
+                rows = cursor.fetchmany(STREAM_BATCH_ROWS)
                 if not rows:
-                    raise ValueError("No rows read with QUOTE_ALL")
-            except Exception as e1:
-                print(f"Failed with QUOTE_ALL: {str(e1)}")
-                f.seek(0)  # Reset file pointer
-                try:
-                    reader = csv.reader(f, quoting=csv.QUOTE_MINIMAL)
-                    rows = list(reader)
-                    print(f"Read {len(rows)} rows with QUOTE_MINIMAL")
-                    if not rows:
-                        raise ValueError("No rows read with QUOTE_MINIMAL")
-                except Exception as e2:
-                    print(f"Failed with QUOTE_MINIMAL: {str(e2)}")
-                    f.seek(0)  # Reset file pointer
-                    reader = csv.reader(f)  # Default settings
-                    rows = list(reader)
-                    print(f"Read {len(rows)} rows with default settings")
-            
-            # Skip header row if it exists based on content
-            start_idx = 0
-            if len(rows) > 0 and len(rows[0]) > 0 and isinstance(rows[0][0], str) and (
-                'date' in rows[0][0].lower() or 
-                'time' in rows[0][0].lower() or
-                (len(rows[0]) > 1 and isinstance(rows[0][1], str) and 'description' in rows[0][1].lower())):
-                print("Skipping header row")
-                start_idx = 1
-            
-            # Process the rows
-            for row in rows[start_idx:]:
-                try:
-                    print(f"Processing row: {row}")
-                    if len(row) < 3:
-                        print(f"Skipping row (not enough columns): {row}")
-                        continue
-                    
-                    # Create a transaction ID
-                    transaction_id = str(uuid.uuid4())
-                    
-                    # Get date and description
-                    date = row[0].strip()
-                    description = row[1].strip()
-                    
-                    # First try column 2 (debit/outgoing)
-                    amount = None
-                    if len(row) > 2 and row[2].strip():
-                        try:
-                            amount_str = row[2].strip().replace(',', '')
-                            amount = -1 * float(amount_str)  # Negative for debits
-                            print(f"Found debit amount: {amount}")
-                        except ValueError as e:
-                            print(f"Invalid debit amount '{row[2]}': {e}")
-                    
-                    # If no amount in column 2, try column 3 (credit/incoming)
-                    if amount is None and len(row) > 3 and row[3].strip():
-                        try:
-                            amount_str = row[3].strip().replace(',', '')
-                            amount = float(amount_str)  # Positive for credits
-                            print(f"Found credit amount: {amount}")
-                        except ValueError as e:
-                            print(f"Invalid credit amount '{row[3]}': {e}")
-                    
-                    # If neither debit nor credit, skip
-                    if amount is None:
-                        print(f"Skipping row, no valid amount: {row}")
-                        continue
-                    
-                    print(f"Processing transaction: {date}, {description}, ${amount}")
-                    
-                    # Insert into database
-                    cursor.execute(
-                        'INSERT INTO transactions (id, date, description, amount, category, currency, account, memo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                        (transaction_id, date, description, amount, '', 'USD', '', '')
-                    )
-                    processed_rows += 1
-                    
-                except Exception as e:
-                    print(f"Error processing row {row}: {str(e)}")
-                    traceback.print_exc()
-        
-        # Commit the changes
-        conn.commit()
-        print(f"Processed {processed_rows} rows using CSV module")
-        
-    except Exception as e:
-        print(f"Error reading CSV: {str(e)}")
-        traceback.print_exc()
-        raise
-        
+                    break
+                if export_format == 'csv':
+                    writer.writerows(rows)
+                    yield buffer.getvalue().encode('utf-8')
+                    buffer.seek(0)
+                    buffer.truncate()
+                else:
+                    yield b''.join(dumps(dict(zip(columns, row))) + b'\n' for row in rows)
+            if export_format == 'csv' and buffer.tell():
+                yield buffer.getvalue().encode('utf-8')
+        finally:
+            conn.close()
+    
+    if export_format == 'csv':
+        return Response(generate(), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=transactions.csv'})
+    return Response(generate(), mimetype='application/x-ndjson')
+
+def cached_json_response(build):
+    """
+    JSON response for the current GET request, reusing the serialized body
+    while the data version is unchanged. Sends 304 Not Modified when the
+    client already holds the current body (If-None-Match), and gzip or
+    brotli when the client accepts it. build() returns the data to encode
+    and may raise ValueError for bad parameters, which the caller handles.
+    """
+    conn = get_db()
+    try:
+        version = data_version(conn)
     finally:
         conn.close()
     
-    return processed_rows
+    key = request.full_path
+    tags = entity_tags(key, version)
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    headers = {'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    
+    for tag in tags.values():
+        if request.if_none_match.contains(tag):
+            response = current_app.response_class(status=304, headers=headers)
+            response.set_etag(tag)
+            return response
+    
+    entry = response_cache.get(key, version)
+    if entry is None:
+        entry = response_cache.put(key, version, dumps(build()))
+    body, used = response_cache.encoded(entry, encoding)
+    
+    response = current_app.response_class(body, mimetype='application/json', headers=headers)
+    if used:
+        response.headers['Content-Encoding'] = used
+    response.set_etag(tags[used])
+    return response
 
-# Route to fetch transactions
-@app.route('/api/transactions', methods=['GET'])
+# Route to fetch transactions. Responses carry an ETag of the data version,
+# so polling clients get 304 Not Modified until something is written.
+@api.route('/api/transactions', methods=['GET'])
 def get_transactions():
-    conn = sqlite3.connect('finance.db')
-    conn.row_factory = sqlite3.Row  # This enables column access by name
-    cursor = conn.cursor()
+    export_format = request.args.get('format', 'json')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        # Exports stream every matching row rather than one page
+        if export_format != 'json':
+            return stream_transactions(request.args, export_format)
+        # Any paging, sorting or filter parameter selects the paginated response
+        if any(param in request.args for param in PAGINATION_PARAMS):
+            return cached_json_response(lambda: query_transactions_page(request.args))
+        # Return empty array with 200 status code when no transactions found
+        # This allows the frontend to handle this more gracefully
+        return cached_json_response(lambda: query_all_transactions(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+# Route to search descriptions and memos, best matches first
+@api.route('/api/transactions/search', methods=['GET'])
+def search_transactions_route():
+    text = request.args.get('q', '')
+    try:
+        try:
+            limit = int(request.args.get('limit', DEFAULT_SEARCH_LIMIT))
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        
+        after = None
+        cursor_arg = request.args.get('cursor')
+        if cursor_arg:
+            after = decode_cursor(cursor_arg, 'rank', 'asc')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    cursor.execute('SELECT * FROM transactions ORDER BY date DESC')
-    transactions = [dict(row) for row in cursor.fetchall()]
+    conn = get_db()
+    try:
+        rows, has_more = search_transactions(conn, text, limit, after)
+    finally:
+        conn.close()
     
-    conn.close()
+    transactions = []
+    for row in rows:
+        transaction = dict(row)
+        del transaction['_score'], transaction['_rowid']
+        transactions.append(transaction)
+    
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor('rank', 'asc', rows[-1]['_score'], rows[-1]['_rowid'])
+    
+    return jsonify({
+        'transactions': transactions,
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+    })
+
+# Columns the summary API can group by, mapped to their SQL expressions. All
+# but merchant are the key of the monthly_rollups table (migration 7) and the
+# leading columns of idx_transactions_summary (migrations 6 and 11).
+SUMMARY_DIMENSIONS = dict(ROLLUP_DIMENSIONS, merchant="IFNULL(merchant, '')")
+MONTH_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+
+# Filters only the transactions table can answer; summaries without them
+# are read from the rollups
+DETAIL_FILTERS = ('search', 'merchant', 'amount', 'date', 'date_from', 'date_to', 'description', 'memo')
+
+def _summary_group_by(value):
+    dimensions = [dimension.strip() for dimension in value.split(',') if dimension.strip()]
+    if not dimensions:
+        raise ValueError('group_by needs at least one of: ' + ', '.join(SUMMARY_DIMENSIONS))
+    for dimension in dimensions:
+        if dimension not in SUMMARY_DIMENSIONS:
+            raise ValueError(f"Cannot group by '{dimension}'; use: {', '.join(SUMMARY_DIMENSIONS)}")
+    # Keep the order asked for but drop repeats
+    return list(dict.fromkeys(dimensions))
+
+def _summary_totals(count, total, income, expenses):
+    return {
+        'count': count,
+        'total': round(total or 0, 2),
+        'income': round(income or 0, 2),
+        'expenses': round(expenses or 0, 2),
+        'average': round(total / count, 2) if count else 0.0,
+    }
+
+def _month_range_filters(args, month):
+    """Conditions for the from and to months (YYYY-MM, inclusive) on the month expression"""
+    clauses = []
+    params = []
+    for arg, operator in (('from', '>='), ('to', '<=')):
+        value = args.get(arg, '')
+        if value:
+            if not MONTH_PATTERN.match(value):
+                raise ValueError(f"{arg} must be a month like 2025-01")
+            clauses.append(f'{month} {operator} ?')
+            params.append(value)
+    return clauses, params
+
+def _rollup_summary_sql(args, selected):
+    """Summary query over monthly_rollups, which holds a handful of rows per month"""
+    clauses, params = _month_range_filters(args, 'month')
+    
+    category = args.get('category', '')
+    if category:
+        clauses.append('category = ?')
+        params.append('' if category == 'Uncategorized' else category)
+    for column in ('account', 'currency'):
+        value = args.get(column, '')
+        if value:
+            clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+            params.append(f'%{_escape_like(value)}%')
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    sql = (
+        f'SELECT {selected}, SUM(count), SUM(total_cents) / 100.0, SUM(income_cents) / 100.0, '
+        f'SUM(expense_cents) / 100.0 FROM monthly_rollups {where} GROUP BY {selected} ORDER BY {selected}'
+    )
+    return sql, params
+
+def _transactions_summary_sql(args, dimensions):
+    """Summary query over the transactions table, for what the rollups cannot answer"""
+    clauses, params = build_transaction_filters(args)
+    month_clauses, month_params = _month_range_filters(args, MONTH_SQL)
+    clauses += month_clauses
+    params += month_params
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    selected = ', '.join(dimensions)
+    
+    if 'merchant' in dimensions:
+        # Grouped straight off the table; idx_transactions_merchant covers
+        # the common case of merchant totals on their own
+        columns = ', '.join(f'{SUMMARY_DIMENSIONS[name]} AS {name}' for name in dimensions)
+        sql = (
+            f'SELECT {columns}, COUNT(*), IFNULL(SUM(amount_cents), 0) / 100.0, '
+            'IFNULL(SUM(CASE WHEN amount_cents > 0 THEN amount_cents END), 0) / 100.0, '
+            'IFNULL(SUM(CASE WHEN amount_cents < 0 THEN amount_cents END), 0) / 100.0 '
+            f'FROM transactions {where} GROUP BY {selected} ORDER BY {selected}'
+        )
+        return sql, params
+    
+    # Aggregate by every rollup dimension first: that GROUP BY follows the
+    # order of the covering summary index, so SQLite reads only the index.
+    # The outer query then folds those groups into the ones asked for.
+    keys = ', '.join(ROLLUP_DIMENSIONS.values())
+    columns = ', '.join(f'{expression} AS {name}' for name, expression in ROLLUP_DIMENSIONS.items())
+    sql = (
+        f'SELECT {selected}, SUM(n), SUM(total) / 100.0, SUM(income) / 100.0, SUM(expenses) / 100.0 FROM ('
+        f'SELECT {columns}, COUNT(*) AS n, IFNULL(SUM(amount_cents), 0) AS total, '
+        'IFNULL(SUM(CASE WHEN amount_cents > 0 THEN amount_cents END), 0) AS income, '
+        'IFNULL(SUM(CASE WHEN amount_cents < 0 THEN amount_cents END), 0) AS expenses '
+        f'FROM transactions {where} GROUP BY {keys}'
+        f') GROUP BY {selected} ORDER BY {selected}'
+    )
+    return sql, params
+
+def query_summary(args, group_by=None):
+    """
+    Totals, counts and averages of the transactions matching the list view's
+    filters, grouped by any of month, category, account, currency and merchant.
+    from and to limit the months (YYYY-MM, inclusive).
+    """
+    dimensions = _summary_group_by(group_by or args.get('group_by', 'month'))
+    
+    if 'merchant' in dimensions or any(args.get(name) for name in DETAIL_FILTERS):
+        sql, params = _transactions_summary_sql(args, dimensions)
+    else:
+        sql, params = _rollup_summary_sql(args, ', '.join(dimensions))
+    
+    conn = get_db()
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
     
-    # Return empty array with 200 status code when no transactions found
-    # This allows the frontend to handle this more gracefully
-    return jsonify(transactions)
+    groups = []
+    overall = [0, 0.0, 0.0, 0.0]
+    width = len(dimensions)
+    for row in rows:
+        group = dict(zip(dimensions, row[:width]))
+        if 'category' in group and not group['category']:
+            group['category'] = 'Uncategorized'
+        group.update(_summary_totals(*row[width:]))
+        groups.append(group)
+        for index, value in enumerate(row[width:]):
+            overall[index] += value or 0
+    
+    return {
+        'group_by': dimensions,
+        'groups': groups,
+        'totals': _summary_totals(*overall),
+    }
+
+# Route to summarize transactions, e.g. /api/summary?group_by=month,category
+@api.route('/api/summary', methods=['GET'])
+@api.route('/api/summary/<group_by>', methods=['GET'])
+def get_summary(group_by=None):
+    try:
+        return cached_json_response(lambda: query_summary(request.args, group_by))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error building summary")
+        return jsonify({'error': str(e)}), 500
 
 # Route to process the example file
-@app.route('/api/process-example', methods=['POST'])
+@api.route('/api/process-example', methods=['POST'])
 def process_example():
     try:
-        print("Processing example file")
+        logger.info("Processing example file")
         
-        # Clear existing transactions before adding new ones
-        clear_transactions()
+        mode = request.values.get('mode', 'merge').lower()
+        if mode not in IMPORT_MODES:
+            return jsonify({'error': f"mode must be one of: {', '.join(IMPORT_MODES)}"}), 400
+        
+        # Merge imports skip rows already stored and keep earlier edits
+        if mode == 'replace':
+            clear_transactions()
         
         # Path to the example file
         example_file_path = os.path.join(os.getcwd(), 'sample_transactions.csv')
@@ -658,30 +1021,270 @@ def process_example():
         
         return jsonify({'message': f'Successfully processed {rows_processed} rows from example file'}), 200
     except Exception as e:
-        print(f"Error processing example file: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error processing example file")
         return jsonify({'error': f'Error processing example file: {str(e)}'}), 500
 
+# Columns PATCH /api/transactions may change; the rollup ones move rows
+# between summary groups and memo is in the search index
+PATCH_FIELDS = ('custom_category', 'currency', 'account', 'memo')
+ROLLUP_PATCH_FIELDS = ('custom_category', 'currency', 'account')
+SEARCH_PATCH_FIELDS = ('memo',)
+
+# Ids per IN (...) list when a patch touches many rows
+PATCH_ID_BATCH = 500
+
+def _patch_values(fields):
+    """Validate the {column: value} part of one change, returning it or raising ValueError"""
+    if not isinstance(fields, dict):
+        raise ValueError('Expected an object of fields to change')
+    unknown = [field for field in fields if field not in PATCH_FIELDS]
+    if unknown:
+        raise ValueError(f"Cannot change {', '.join(unknown)}; use: {', '.join(PATCH_FIELDS)}")
+    if not fields:
+        raise ValueError('No fields to change')
+    for field, value in fields.items():
+        if not isinstance(value, str):
+            raise ValueError(f'{field} must be a string')
+    if 'currency' in fields and not fields['currency']:
+        raise ValueError('Currency cannot be empty')
+    return fields
+
+def _id_batches(ids):
+    for start in range(0, len(ids), PATCH_ID_BATCH):
+        batch = ids[start:start + PATCH_ID_BATCH]
+        yield f"id IN ({', '.join('?' * len(batch))})", batch
+
+def apply_transaction_changes(conn, changes):
+    """
+    Apply [(id, {column: value}), ...] in one write transaction: rows leave
+    their rollup group and search entry, the updates run with one
+    executemany per set of columns, and the rows are added back.
+    Returns the set of ids that exist.
+    """
+    # Later changes to the same row win
+    merged = {}
+    for transaction_id, fields in changes:
+        merged.setdefault(transaction_id, {}).update(fields)
+    ids = list(merged)
+    touched = set()
+    for fields in merged.values():
+        touched.update(fields)
+    rollups_change = any(field in touched for field in ROLLUP_PATCH_FIELDS)
+    search_changes = any(field in touched for field in SEARCH_PATCH_FIELDS)
+    
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        found = set()
+        for where, batch in _id_batches(ids):
+            found.update(row[0] for row in conn.execute(f'SELECT id FROM transactions WHERE {where}', batch))
+        found_ids = [transaction_id for transaction_id in ids if transaction_id in found]
+        
+        for where, batch in _id_batches(found_ids):
+            if rollups_change:
+                remove_from_rollups(conn, where, batch)
+            if search_changes:
+                unindex_transactions(conn, where, batch)
+        
+        # Rows setting the same columns share one statement
+        statements = {}
+        for transaction_id, fields in merged.items():
+            if transaction_id in found:
+                columns = tuple(sorted(fields))
+                statements.setdefault(columns, []).append(
+                    tuple(fields[column] for column in columns) + (transaction_id,))
+        for columns, rows in statements.items():
+            assignments = ', '.join(f'{column} = ?' for column in columns)
+            conn.executemany(f'UPDATE transactions SET {assignments} WHERE id = ?', rows)
+        
+        for where, batch in _id_batches(found_ids):
+            if rollups_change:
+                add_to_rollups(conn, where, batch)
+            if search_changes:
+                index_transactions(conn, where, batch)
+        if found_ids:
+            bump_data_version(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return found
+
+# Route to edit many transactions at once. The body is either
+#   {"changes": [{"id": "...", "custom_category": "Food"}, ...]}
+# or {"filter": {...transactions API filters...}, "set": {"custom_category": "Food"}}
+@api.route('/api/transactions', methods=['PATCH'])
+def patch_transactions():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or ('changes' in data) == ('filter' in data):
+        return jsonify({'error': "Expected a JSON object with either 'changes' or 'filter' and 'set'"}), 400
+    
+    results = []
+    changes = []
+    conn = None
+    try:
+        if 'filter' in data:
+            filters = data['filter']
+            if not isinstance(filters, dict):
+                return jsonify({'error': 'filter must be an object'}), 400
+            try:
+                fields = _patch_values(data.get('set'))
+                clauses, params = build_transaction_filters(
+                    {key: str(value) for key, value in filters.items() if value not in (None, '')})
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if not clauses:
+                return jsonify({'error': 'filter must match on at least one field'}), 400
+            
+            conn = get_db()
+            matched = [row[0] for row in conn.execute(
+                f"SELECT id FROM transactions WHERE {' AND '.join(clauses)}", params)]
+            found = apply_transaction_changes(conn, [(transaction_id, fields) for transaction_id in matched])
+            return jsonify({'matched': len(matched), 'updated': len(found)})
+        
+        items = data['changes']
+        if not isinstance(items, list):
+            return jsonify({'error': 'changes must be a list'}), 400
+        for item in items:
+            transaction_id = item.get('id') if isinstance(item, dict) else None
+            if not isinstance(transaction_id, str) or not transaction_id:
+                results.append({'id': transaction_id, 'status': 'invalid', 'error': 'Missing transaction id'})
+                continue
+            try:
+                fields = _patch_values({key: value for key, value in item.items() if key != 'id'})
+            except ValueError as e:
+                results.append({'id': transaction_id, 'status': 'invalid', 'error': str(e)})
+                continue
+            results.append({'id': transaction_id, 'status': None})
+            changes.append((transaction_id, fields))
+        
+        found = set()
+        if changes:
+            conn = get_db()
+            found = apply_transaction_changes(conn, changes)
+        for result in results:
+            if result['status'] is None:
+                result['status'] = 'updated' if result['id'] in found else 'not_found'
+        
+        return jsonify({
+            'updated': sum(1 for result in results if result['status'] == 'updated'),
+            'results': results,
+        })
+    except Exception as e:
+        logger.exception("Error updating transactions")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if conn is not None:
+            conn.close()
+
+def _rule_dict(row):
+    return dict(zip(RULE_COLUMNS, row))
+
+def _get_rule(conn, rule_id):
+    row = conn.execute(f"SELECT {', '.join(RULE_COLUMNS)} FROM categorization_rules WHERE id = ?",
+                       (rule_id,)).fetchone()
+    return _rule_dict(row) if row else None
+
+# Route to list categorization rules in the order they are tried
+@api.route('/api/rules', methods=['GET'])
+def list_rules():
+    conn = get_db()
+    try:
+        cursor = conn.execute(f"SELECT {', '.join(RULE_COLUMNS)} FROM categorization_rules "
+                              'ORDER BY priority DESC, id')
+        return jsonify([_rule_dict(row) for row in cursor])
+    finally:
+        conn.close()
+
+# Route to add a categorization rule; it applies to later imports and to POST /api/rules/apply
+@api.route('/api/rules', methods=['POST'])
+def create_rule():
+    try:
+        rule = validate_rule(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db()
+    try:
+        columns = list(rule) + ['created_at']
+        cursor = conn.execute(
+            f"INSERT INTO categorization_rules ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            list(rule.values()) + [datetime.datetime.now().isoformat(timespec='seconds')]
+        )
+        conn.commit()
+        return jsonify(_get_rule(conn, cursor.lastrowid)), 201
+    finally:
+        conn.close()
+
+# Route to replace a categorization rule
+@api.route('/api/rules/<int:rule_id>', methods=['PUT'])
+def update_rule(rule_id):
+    try:
+        rule = validate_rule(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db()
+    try:
+        assignments = ', '.join(f'{column} = ?' for column in rule)
+        cursor = conn.execute(f'UPDATE categorization_rules SET {assignments} WHERE id = ?',
+                              list(rule.values()) + [rule_id])
+        if cursor.rowcount == 0:
+            return jsonify({'error': 'Rule not found'}), 404
+        conn.commit()
+        return jsonify(_get_rule(conn, rule_id))
+    finally:
+        conn.close()
+
+# Route to delete a categorization rule. Rows it categorized keep their
+# category until the rules are applied again.
+@api.route('/api/rules/<int:rule_id>', methods=['DELETE'])
+def delete_rule(rule_id):
+    conn = get_db()
+    try:
+        cursor = conn.execute('DELETE FROM categorization_rules WHERE id = ?', (rule_id,))
+        if cursor.rowcount == 0:
+            return jsonify({'error': 'Rule not found'}), 404
+        conn.commit()
+        return jsonify({'message': 'Rule deleted'})
+    finally:
+        conn.close()
+
+# Route to re-run the rules over every transaction without an imported category
+@api.route('/api/rules/apply', methods=['POST'])
+def apply_rules_route():
+    conn = get_db()
+    try:
+        return jsonify(apply_rules(conn))
+    except Exception as e:
+        logger.exception("Error applying rules")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
 # Route to update transaction category
-@app.route('/api/transactions/<transaction_id>/category', methods=['PUT'])
+@api.route('/api/transactions/<transaction_id>/category', methods=['PUT'])
 def update_transaction_category(transaction_id):
     try:
         custom_category = request.json['custom_category']
         
-        conn = sqlite3.connect('finance.db')
+        conn = get_db()
         cursor = conn.cursor()
+        # Move the row from its old rollup group to the new one
+        remove_from_rollups(conn, 'id = ?', (transaction_id,))
         cursor.execute('UPDATE transactions SET custom_category = ? WHERE id = ?',
                     (custom_category, transaction_id))
+        add_to_rollups(conn, 'id = ?', (transaction_id,))
+        bump_data_version(conn)
         conn.commit()
         conn.close()
         
         return jsonify({'success': True})
     except Exception as e:
-        print(f"Error updating category: {str(e)}")
+        logger.exception("Error updating category")
         return jsonify({'error': str(e)}), 500
 
 # Route to update transaction currency
-@app.route('/api/transaction/<transaction_id>/currency', methods=['PUT'])
+@api.route('/api/transaction/<transaction_id>/currency', methods=['PUT'])
 def update_transaction_currency(transaction_id):
     try:
         data = request.get_json()
@@ -690,102 +1293,163 @@ def update_transaction_currency(transaction_id):
         if not currency:
             return jsonify({'error': 'Currency cannot be empty'}), 400
             
-        conn = sqlite3.connect('finance.db')
+        conn = get_db()
         cursor = conn.cursor()
         
+        remove_from_rollups(conn, 'id = ?', (transaction_id,))
         cursor.execute(
             'UPDATE transactions SET currency = ? WHERE id = ?',
             (currency, transaction_id)
         )
+        add_to_rollups(conn, 'id = ?', (transaction_id,))
         
         if cursor.rowcount == 0:
             conn.close()
             return jsonify({'error': 'Transaction not found'}), 404
             
+        bump_data_version(conn)
         conn.commit()
         conn.close()
         
         return jsonify({'message': 'Currency updated successfully'})
         
     except Exception as e:
-        print(f"Error updating currency: {str(e)}")
+        logger.exception("Error updating currency")
         return jsonify({'error': str(e)}), 500
 
 # Route to update transaction account
-@app.route('/api/transaction/<transaction_id>/account', methods=['PUT'])
+@api.route('/api/transaction/<transaction_id>/account', methods=['PUT'])
 def update_transaction_account(transaction_id):
     try:
         data = request.get_json()
         account = data.get('account', '')
             
-        conn = sqlite3.connect('finance.db')
+        conn = get_db()
         cursor = conn.cursor()
         
+        remove_from_rollups(conn, 'id = ?', (transaction_id,))
         cursor.execute(
             'UPDATE transactions SET account = ? WHERE id = ?',
             (account, transaction_id)
         )
+        add_to_rollups(conn, 'id = ?', (transaction_id,))
         
         if cursor.rowcount == 0:
             conn.close()
             return jsonify({'error': 'Transaction not found'}), 404
             
+        bump_data_version(conn)
         conn.commit()
         conn.close()
         
         return jsonify({'message': 'Account updated successfully'})
         
     except Exception as e:
-        print(f"Error updating account: {str(e)}")
+        logger.exception("Error updating account")
         return jsonify({'error': str(e)}), 500
 
 # Route to update transaction memo
-@app.route('/api/transaction/<transaction_id>/memo', methods=['PUT'])
+@api.route('/api/transaction/<transaction_id>/memo', methods=['PUT'])
 def update_transaction_memo(transaction_id):
     try:
         data = request.get_json()
         memo = data.get('memo', '')
             
-        conn = sqlite3.connect('finance.db')
+        conn = get_db()
         cursor = conn.cursor()
         
+        # The search index drops the old memo's tokens and takes the new ones
+        unindex_transactions(conn, 'id = ?', (transaction_id,))
         cursor.execute(
             'UPDATE transactions SET memo = ? WHERE id = ?',
             (memo, transaction_id)
         )
+        index_transactions(conn, 'id = ?', (transaction_id,))
         
         if cursor.rowcount == 0:
             conn.close()
             return jsonify({'error': 'Transaction not found'}), 404
             
+        bump_data_version(conn)
         conn.commit()
         conn.close()
         
         return jsonify({'message': 'Memo updated successfully'})
         
     except Exception as e:
-        print(f"Error updating memo: {str(e)}")
+        logger.exception("Error updating memo")
         return jsonify({'error': str(e)}), 500
 
+# Route to inspect the database connection pool
+@api.route('/api/db/pool', methods=['GET'])
+def get_pool_stats():
+    return jsonify(pool.stats())
+
+# Route for Prometheus to scrape. Each worker process keeps its own numbers.
+@api.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    pool_stats = pool.stats()
+    cache_stats = response_cache.stats()
+    extra = (
+        sample_lines('db_pool_connections_in_use', 'gauge', 'Pooled connections checked out', pool_stats['in_use'])
+        + sample_lines('db_pool_connections_idle', 'gauge', 'Pooled connections ready for reuse', pool_stats['idle'])
+        + sample_lines('db_pool_checkouts_total', 'counter', 'Connections borrowed from the pool',
+                       pool_stats['checkouts'])
+        + sample_lines('response_cache_bytes', 'gauge', 'Memory held by cached responses', cache_stats['bytes'])
+        + sample_lines('response_cache_hits_total', 'counter', 'Responses served from the cache', cache_stats['hits'])
+        + sample_lines('response_cache_misses_total', 'counter', 'Responses that had to be built',
+                       cache_stats['misses'])
+    )
+    return Response(render_metrics(extra), mimetype='text/plain; version=0.0.4')
+
 # Route to delete all transactions
-@app.route('/api/transactions/delete-all', methods=['DELETE'])
+@api.route('/api/transactions/delete-all', methods=['DELETE'])
 def delete_all_transactions():
     try:
         clear_transactions()
         return jsonify({"message": "All transactions successfully deleted"}), 200
     except Exception as e:
-        print(f"Error deleting transactions: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error deleting transactions")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 # Serve frontend static files in production
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
+@api.route('/', defaults={'path': ''})
+@api.route('/<path:path>')
 def serve(path):
-    if path != "" and os.path.exists(app.static_folder + '/' + path):
-        return send_from_directory(app.static_folder, path)
+    if path != "" and os.path.exists(current_app.static_folder + '/' + path):
+        return send_from_directory(current_app.static_folder, path)
     else:
-        return send_from_directory(app.static_folder, 'index.html')
+        return send_from_directory(current_app.static_folder, 'index.html')
+
+def create_app():
+    """
+    Build the Flask application with every API route registered. The
+    database schema is brought up to date on the first call in a process.
+    """
+    app = Flask(__name__, static_folder='frontend/build', static_url_path='')
+    # orjson is optional; with it installed every JSON response is encoded faster
+    if orjson is not None:
+        app.json = FastJSONProvider(app)
+    # Enable CORS with maximum permissiveness
+    CORS(app)
+    app.register_blueprint(api)
+    ensure_schema()
+    return app
+
+_app = None
+_app_lock = threading.Lock()
+
+def __getattr__(name):
+    # app.app (gunicorn app:app, flask run, scripts) is built on first use
+    # rather than at import. Importing the module stays cheap, e.g. for the
+    # batch upload's parse processes, which re-import it under python app.py.
+    global _app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+    return _app
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    create_app().run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,281 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from database import bump_data_version
+from merchants import canonical_merchant
+from rollups import add_to_rollups, remove_from_rollups
+from rules import load_matcher
+from search import index_transactions, unindex_transactions
+
+logger = logging.getLogger(__name__)
+
+# Number of rows buffered before they are flushed to SQLite in one transaction
+INSERT_BATCH_SIZE = int(os.environ.get('INSERT_BATCH_SIZE', '5000'))
+
+INSERT_TRANSACTION_SQL = (
+    'INSERT INTO transactions (id, date, description, amount, category, currency, account, memo, fingerprint, '
+    'merchant, amount_cents, rule_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+
+# Position of the fingerprint in a buffered (date, description, amount,
+# category, currency, account, memo, fingerprint, merchant, amount_cents) row
+FINGERPRINT_INDEX = 7
+
+# Date layouts found in bank exports, tried in order; US month-first dates
+# win over day-first ones
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%Y/%m/%d', '%m-%d-%Y', '%d.%m.%Y', '%b %d, %Y', '%d %b %Y')
+
+# Fingerprints looked up per query when checking a chunk for rows already stored
+FINGERPRINT_LOOKUP_SIZE = 500
+
+# Writers of one process take turns chunk by chunk. Each chunk starts with
+# BEGIN IMMEDIATE, so its duplicate check and insert see the same snapshot
+# and a writer in another process waits for the lock instead of failing
+# with "database is locked" when its read transaction is upgraded.
+_write_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4096)
+def normalize_date(value):
+    """
+    ISO YYYY-MM-DD form of an exported date, so dates sort and range-scan
+    correctly. Text that is not a recognised date is kept as it is.
+    """
+    if value is None:
+        return None
+    text = str(value).strip()
+    # ISO timestamps keep just their date
+    if len(text) > 10 and text[4:5] == '-' and text[10] in 'T ':
+        text = text[:10]
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    return text
+
+
+def amount_cents(amount):
+    """Amount in integer cents, None when there is no amount"""
+    if amount is None or amount != amount:
+        return None
+    return int(round(amount * 100))
+
+
+def _fingerprint_text(value):
+    return '' if value is None else str(value).strip()
+
+
+def transaction_fingerprint(date, description, amount, account):
+    """
+    Deterministic key for a transaction's content, used to recognise rows a
+    previous import already stored. Edits made later in the app (category,
+    memo, account) do not change the fingerprint of the stored row.
+    """
+    if isinstance(amount, (int, float)):
+        # 12 and 12.0 must hash alike, as must -0.0 and 0.0; NaN means no amount
+        amount = '' if amount != amount else repr(float(amount) + 0.0)
+    key = (f'{_fingerprint_text(date)}\x1f{_fingerprint_text(description)}\x1f'
+           f'{_fingerprint_text(amount)}\x1f{_fingerprint_text(account)}')
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class BatchedWriter:
+    """
+    Buffers transaction rows and writes them with executemany, one explicit
+    transaction per chunk. Each chunk's row count and throughput are logged
+    at DEBUG level.
+
+    Use it as a context manager so the last partial chunk is flushed:
+
+        with BatchedWriter(conn) as writer:
+            writer.add(date, description, amount)
+
+    With atomic=True a failed import leaves nothing behind: if the block
+    exits with an exception, the rows of the chunks already committed are
+    deleted again, with their rollup and search index entries. Chunks are
+    still committed one by one, so other writers are never locked out for
+    the length of a whole file.
+
+    With dedupe=True (the default) rows whose fingerprint matches a row that
+    was already stored when the writer was created are skipped, so importing
+    an export that overlaps earlier ones only adds the new rows. Identical
+    rows within the same import are all kept, e.g. two equal coffees on one day.
+
+    With categorize=True (the default) rows imported without a category get
+    one from the first matching categorization rule (see rules.py).
+
+    progress, if given, is called as progress(rows_written, rows_skipped)
+    after every chunk.
+    """
+
+    def __init__(self, conn, batch_size=None, label='import', atomic=False, dedupe=True, categorize=True,
+                 progress=None):
+        self.conn = conn
+        self.batch_size = max(1, batch_size or INSERT_BATCH_SIZE)
+        self.label = label
+        self.atomic = atomic
+        self.dedupe = dedupe
+        self.progress = progress
+        self.rows_written = 0
+        self.rows_skipped = 0
+        self.rows_categorized = 0
+        self.chunks_written = 0
+        self.write_seconds = 0.0
+        self._buffer = []
+        # (after, last) rowid range of every chunk committed, for atomic rollback
+        self._written = []
+        # Rows inserted by this import get higher rowids, so only rows at or
+        # below this one count as already imported
+        self._stored_rowid = None
+        if dedupe:
+            self._stored_rowid = conn.execute('SELECT IFNULL(MAX(rowid), 0) FROM transactions').fetchone()[0]
+        # Rules are compiled once per import and applied to each chunk
+        self.matcher = load_matcher(conn) if categorize else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            # Drop the unwritten tail; outside atomic mode committed chunks stay
+            self._buffer = []
+            if self.atomic:
+                self._discard_written()
+        return False
+
+    def add(self, date, description, amount, category='', currency='USD', account='', memo=''):
+        """Queue one transaction, flushing when the chunk is full"""
+        date = normalize_date(date)
+        fingerprint = transaction_fingerprint(date, description, amount, account)
+        self._buffer.append((date, description, amount, category, currency, account, memo, fingerprint,
+                             canonical_merchant(description), amount_cents(amount)))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, rows):
+        """Queue (date, description, amount, category, currency, account, memo) tuples"""
+        for row in rows:
+            date, description, amount, category, currency, account, memo = row
+            date = normalize_date(date)
+            fingerprint = transaction_fingerprint(date, description, amount, account)
+            self._buffer.append((date, description, amount, category, currency, account, memo, fingerprint,
+                                 canonical_merchant(description), amount_cents(amount)))
+            if len(self._buffer) >= self.batch_size:
+                self.flush()
+
+    def _already_stored(self, rows):
+        """Fingerprints of the chunk that match rows stored before this import"""
+        fingerprints = list({row[FINGERPRINT_INDEX] for row in rows})
+        stored = set()
+        for start in range(0, len(fingerprints), FINGERPRINT_LOOKUP_SIZE):
+            batch = fingerprints[start:start + FINGERPRINT_LOOKUP_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            cursor = self.conn.execute(
+                f'SELECT fingerprint FROM transactions WHERE fingerprint IN ({placeholders}) AND rowid <= ?',
+                batch + [self._stored_rowid]
+            )
+            stored.update(fingerprint for (fingerprint,) in cursor)
+        return stored
+
+    def _discard_written(self):
+        """Delete the rows of every chunk this writer committed"""
+        if not self._written:
+            return
+        # Consecutive chunks usually form one range
+        ranges = []
+        for after, last in self._written:
+            if ranges and ranges[-1][1] == after:
+                ranges[-1][1] = last
+            else:
+                ranges.append([after, last])
+        where = ' OR '.join('(rowid > ? AND rowid <= ?)' for _ in ranges)
+        params = [bound for rowid_range in ranges for bound in rowid_range]
+        with _write_lock:
+            try:
+                self.conn.execute('BEGIN IMMEDIATE')
+                remove_from_rollups(self.conn, where, params)
+                unindex_transactions(self.conn, where, params)
+                self.conn.execute(f'DELETE FROM transactions WHERE {where}', params)
+                bump_data_version(self.conn)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        self._written = []
+
+    def flush(self):
+        """Write the buffered rows in a single transaction"""
+        if not self._buffer:
+            return 0
+
+        rows = self._buffer
+        self._buffer = []
+        queued = len(rows)
+
+        start = time.perf_counter()
+        with _write_lock:
+            try:
+                if not self.conn.in_transaction:
+                    self.conn.execute('BEGIN IMMEDIATE')
+                if self.dedupe and self._stored_rowid:
+                    stored = self._already_stored(rows)
+                    if stored:
+                        rows = [row for row in rows if row[FINGERPRINT_INDEX] not in stored]
+                categorized = 0
+                if rows:
+                    if self.matcher is not None and self.matcher.has_rules:
+                        rows, categorized = self.matcher.categorize_rows(rows)
+                    else:
+                        rows = [row + (None,) for row in rows]
+                    last_rowid = self.conn.execute('SELECT IFNULL(MAX(rowid), 0) FROM transactions').fetchone()[0]
+                    # Ids are only generated for the rows actually inserted
+                    self.conn.executemany(INSERT_TRANSACTION_SQL, ((str(uuid.uuid4()),) + row for row in rows))
+                    # Fold the chunk into the monthly rollups and the search index in the same transaction
+                    add_to_rollups(self.conn, 'rowid > ?', (last_rowid,))
+                    index_transactions(self.conn, 'rowid > ?', (last_rowid,))
+                    bump_data_version(self.conn)
+                    self._written.append(
+                        (last_rowid, self.conn.execute('SELECT MAX(rowid) FROM transactions').fetchone()[0]))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        elapsed = time.perf_counter() - start
+
+        skipped = queued - len(rows)
+        self.rows_written += len(rows)
+        self.rows_skipped += skipped
+        self.rows_categorized += categorized
+        self.chunks_written += 1
+        self.write_seconds += elapsed
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[%s] chunk %d: wrote %d rows", self.label, self.chunks_written, len(rows), extra={
+                'skipped': skipped,
+                'categorized': categorized,
+                'ms': round(elapsed * 1000, 1),
+                'rows_per_second': round(queued / elapsed) if elapsed > 0 else 0,
+            })
+        if self.progress is not None:
+            self.progress(self.rows_written, self.rows_skipped)
+        return len(rows)
+
+    def stats(self):
+        """Totals for everything flushed so far"""
+        rate = (self.rows_written + self.rows_skipped) / self.write_seconds if self.write_seconds > 0 else 0.0
+        return {
+            'rows': self.rows_written,
+            'skipped': self.rows_skipped,
+            'categorized': self.rows_categorized,
+            'chunks': self.chunks_written,
+            'seconds': round(self.write_seconds, 6),
+            'rows_per_second': round(rate, 1),
+        }
@@ -0,0 +1,252 @@
+"""
+Latency and throughput of the read/write API under concurrency.
+
+    python benchmarks/api_benchmark.py --rows 100000 --concurrency 1 4 16
+    python benchmarks/api_benchmark.py --server --save api_baseline.json
+
+Seeds a temporary database, then for each scenario and concurrency level
+sends --requests requests from that many threads and reports p50/p95/p99
+latency and requests per second. Requests go through Flask's test client,
+or with --server over HTTP to a threaded local server, which adds sockets
+and the WSGI server to the measurement. DELETE /api/transactions/delete-all
+empties the table, so it runs once at the end and reports that one request.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from serialization_benchmark import seed
+
+CATEGORIES = ('Food', 'Travel', 'Bills', 'Shopping')
+CURRENCIES = ('USD', 'EUR', 'GBP', 'CAD')
+ACCOUNTS = ('Checking', 'Card', 'Savings')
+
+# Share of writes in the mixed scenario; the rest are page reads
+MIXED_WRITE_SHARE = 0.1
+
+
+def _put(path, body):
+    return lambda ids, rng: ('PUT', path.format(id=rng.choice(ids)), body(rng))
+
+
+def _get(path):
+    return lambda ids, rng: ('GET', path, None)
+
+
+WRITES = {
+    'put-category': _put('/api/transactions/{id}/category',
+                         lambda rng: {'custom_category': rng.choice(CATEGORIES)}),
+    'put-currency': _put('/api/transaction/{id}/currency', lambda rng: {'currency': rng.choice(CURRENCIES)}),
+    'put-account': _put('/api/transaction/{id}/account', lambda rng: {'account': rng.choice(ACCOUNTS)}),
+    'put-memo': _put('/api/transaction/{id}/memo', lambda rng: {'memo': f'note {rng.randint(1, 10 ** 6)}'}),
+}
+
+
+def _mixed(ids, rng):
+    if rng.random() < MIXED_WRITE_SHARE:
+        return rng.choice(list(WRITES.values()))(ids, rng)
+    return SCENARIOS['get-page'](ids, rng)
+
+
+def delete_all(ids, rng):
+    return 'DELETE', '/api/transactions/delete-all', None
+
+
+# Each scenario builds (method, path, JSON body) for one request
+SCENARIOS = {
+    'get-page': _get('/api/transactions?limit=50'),
+    'get-page-filtered': _get('/api/transactions?limit=50&category=Food&sort=amount&direction=asc'),
+    'get-all': _get('/api/transactions'),
+    **WRITES,
+    'mixed': _mixed,
+}
+
+
+class TestClientSender:
+    """Sends requests through one Flask test client per thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def __call__(self, method, path, body):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class ServerSender:
+    """Sends requests over HTTP to the app served by a threaded local server"""
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+
+        # The access log line per request would be measured too
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.local = threading.local()
+
+    def __call__(self, method, path, body):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection('127.0.0.1', self.server.server_port)
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, path, body=data, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_level(send, scenario, ids, requests, concurrency):
+    """Send requests requests from concurrency threads; latencies in seconds and the errors"""
+    remaining = iter(range(requests))
+    remaining_lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def worker(number):
+        rng = random.Random(number)
+        while True:
+            with remaining_lock:
+                if next(remaining, None) is None:
+                    return
+            method, path, body = scenario(ids, rng)
+            start = time.perf_counter()
+            status = send(method, path, body)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(f'{method} {path}: {status}')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker, number) for number in range(concurrency)]:
+            future.result()
+    return latencies, errors, time.perf_counter() - start
+
+
+def summarize(latencies, errors, seconds):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'requests_per_second': round(len(latencies) / seconds, 1),
+    }
+
+
+def _print_row(entry):
+    print(f"{entry['scenario']:<20} {entry['concurrency']:>5} {entry['requests']:>8} {entry['errors']:>6} "
+          f"{entry['p50_ms']:>9.2f} {entry['p95_ms']:>9.2f} {entry['p99_ms']:>9.2f} "
+          f"{entry['requests_per_second']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='transactions to seed (default 100000)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16],
+                        help='threads sending requests at once (default 1 4 16)')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per scenario and concurrency level (default 500)')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+                        help='scenarios to run (default: all)')
+    parser.add_argument('--server', action='store_true',
+                        help='send requests over HTTP to a threaded local server instead of the test client')
+    parser.add_argument('--skip-delete', action='store_true', help='do not time DELETE /api/transactions/delete-all')
+    parser.add_argument('--save', metavar='PATH', help='write the results as JSON')
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='budget-api-')
+    database = os.path.join(workdir, 'finance.db')
+    os.environ['FINANCE_DB'] = database
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    import app
+    application = app.create_app()
+    seed(options.rows)
+    conn = sqlite3.connect(database)
+    ids = [row[0] for row in conn.execute('SELECT id FROM transactions')]
+    conn.close()
+
+    send = ServerSender(application) if options.server else TestClientSender(application)
+    results = []
+    print(f"{options.rows} rows, {'local HTTP server' if options.server else 'test client'}")
+    print(f"{'scenario':<20} {'conc':>5} {'requests':>8} {'errors':>6} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+    try:
+        for name in options.scenarios:
+            for concurrency in options.concurrency:
+                latencies, errors, seconds = run_level(send, SCENARIOS[name], ids, options.requests, concurrency)
+                entry = {'scenario': name, 'concurrency': concurrency, **summarize(latencies, errors, seconds)}
+                results.append(entry)
+                _print_row(entry)
+                for error in errors[:3]:
+                    print(f'  {error}')
+        if not options.skip_delete:
+            latencies, errors, seconds = run_level(send, delete_all, ids, 1, 1)
+            entry = {'scenario': 'delete-all', 'concurrency': 1, **summarize(latencies, errors, seconds)}
+            results.append(entry)
+            _print_row(entry)
+    finally:
+        send.close()
+        app.pool.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if options.save:
+        report = {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'rows': options.rows,
+            'client': 'server' if options.server else 'test_client',
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'results': results,
+        }
+        with open(options.save, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f'Saved results to {options.save}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+Time CSV imports of generated bank exports against a temporary database.
+
+    python benchmarks/ingest_benchmark.py --rows 10000 100000 1000000 --save ingest_baseline.json
+    python benchmarks/ingest_benchmark.py --rows 100000 --compare ingest_baseline.json
+
+Writes a file in each supported layout (budget Outflow/Inflow, date/
+description/debit/credit with a header, headerless account activity) and
+runs every processor that reads that layout, each in a fresh process with
+a fresh database, so peak RSS belongs to that one import. Reports rows per
+second, peak RSS and the database size. --save writes the results as a JSON
+baseline; --compare exits 1 if any case is slower or bigger than the
+baseline by more than --tolerance.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MERCHANTS = ('STARBUCKS #552 SEATTLE WA', 'AMAZON.COM*MK1234', 'SHELL OIL 5739', 'TRADER JOES #123',
+             'NETFLIX.COM', 'UBER *TRIP', 'PAYROLL DEPOSIT', 'CITY WATER UTIL', 'COSTCO WHSE #0012',
+             'SQ *BLUE BOTTLE COFFEE', 'DELTA AIR 0062', 'PG&E WEB ONLINE')
+CATEGORIES = (('Everyday', 'Groceries'), ('Everyday', 'Restaurants'), ('Bills', 'Utilities'),
+              ('Bills', 'Subscriptions'), ('Travel', 'Flights'), ('Income', 'Paycheck'))
+ACCOUNTS = ('Checking', 'Savings', 'Visa')
+
+# Share of generated rows that are credits (deposits, refunds)
+CREDIT_SHARE = 0.15
+
+# Layout of each generated file and the processors that read it, as module:function
+LAYOUTS = {
+    'budget': ('app:process_budget_format',),
+    'debit_credit': ('app:process_sample_transactions_csv',),
+    'account_activity': ('app:process_account_activity_csv', 'app:process_default_format',
+                         'simple_upload_server:process_csv'),
+}
+
+# Result fields --compare checks, and whether a bigger value is better
+COMPARED_FIELDS = {'rows_per_second': True, 'peak_rss_mb': False, 'db_mb': False}
+
+
+def _transactions(rows, seed):
+    """(date, description, amount) tuples over about two years, newest first"""
+    rng = random.Random(seed)
+    start = datetime.date(2025, 6, 30)
+    for index in range(rows):
+        day = start - datetime.timedelta(days=index * 730 // max(rows, 1))
+        amount = round(rng.uniform(1, 2500), 2) if rng.random() < CREDIT_SHARE else -round(rng.uniform(1, 250), 2)
+        yield day, f'{rng.choice(MERCHANTS)} {rng.randint(1000, 9999)}', amount, rng
+
+
+def write_budget(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(('Account', 'Flag', 'Date', 'Payee', 'Category Group/Category', 'Category Group',
+                         'Category', 'Memo', 'Outflow', 'Inflow', 'Cleared'))
+        for day, description, amount, rng in _transactions(rows, 1):
+            group, category = rng.choice(CATEGORIES)
+            outflow, inflow = (f'${-amount:,.2f}', '$0.00') if amount < 0 else ('$0.00', f'${amount:,.2f}')
+            writer.writerow((rng.choice(ACCOUNTS), '', day.strftime('%m/%d/%Y'), description,
+                             f'{group}: {category}', group, category, '', outflow, inflow, 'Cleared'))
+
+
+def write_debit_credit(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('date', 'description', 'debit', 'credit'))
+        for day, description, amount, _ in _transactions(rows, 2):
+            debit, credit = (f'{-amount:.2f}', '') if amount < 0 else ('', f'{amount:.2f}')
+            writer.writerow((day.isoformat(), description, debit, credit))
+
+
+def write_account_activity(path, rows):
+    balance = 25000.0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        for day, description, amount, _ in _transactions(rows, 3):
+            balance += amount
+            debit, credit = (f'{-amount:,.2f}', '') if amount < 0 else ('', f'{amount:,.2f}')
+            writer.writerow((day.strftime('%m/%d/%Y'), description, debit, credit, f'{balance:,.2f}'))
+
+
+WRITERS = {
+    'budget': write_budget,
+    'debit_credit': write_debit_credit,
+    'account_activity': write_account_activity,
+}
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(processor, path, database):
+    """
+    Body of the child process: create the schema, run one processor on path
+    and print its measurements as one JSON line
+    """
+    os.environ['FINANCE_DB'] = database
+    from database import get_db
+    from migrations import apply_migrations
+
+    conn = get_db()
+    apply_migrations(conn)
+    conn.close()
+
+    module_name, function_name = processor.split(':')
+    function = getattr(__import__(module_name), function_name)
+    rss_before = _peak_rss_mb()
+
+    start = time.perf_counter()
+    result = function(path)
+    seconds = time.perf_counter() - start
+    if isinstance(result, dict) and 'error' in result:
+        raise RuntimeError(result['error'])
+
+    conn = sqlite3.connect(database)
+    stored = conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    print(json.dumps({
+        'rows_stored': stored,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(stored / seconds) if seconds else None,
+        'rss_before_mb': round(rss_before, 1),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'db_mb': round(os.path.getsize(database) / 1e6, 2),
+    }))
+
+
+def measure(processor, path, workdir):
+    database = os.path.join(workdir, 'finance.db')
+    for leftover in (database, database + '-wal', database + '-shm'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', processor, path, database],
+                               cwd=workdir, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f'{processor} failed on {os.path.basename(path)}:\n{completed.stderr}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing every case worse than baseline by more than tolerance"""
+    previous = {(entry['layout'], entry['processor'], entry['rows']): entry for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        old = previous.get((entry['layout'], entry['processor'], entry['rows']))
+        if old is None:
+            continue
+        for field, higher_is_better in COMPARED_FIELDS.items():
+            if not old.get(field) or entry.get(field) is None:
+                continue
+            change = entry[field] / old[field] - 1
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{entry['processor']} {entry['rows']} rows: {field} "
+                                   f"{old[field]} -> {entry[field]} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--case':
+        run_case(*sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='rows per generated file (default 10000 100000 1000000)')
+    parser.add_argument('--layouts', nargs='+', choices=sorted(LAYOUTS), default=list(LAYOUTS),
+                        help='layouts to generate (default: all)')
+    parser.add_argument('--save', metavar='PATH', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare with a baseline written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative change --compare accepts (default 0.2)')
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='budget-ingest-')
+    results = []
+    print(f"{'layout':<18} {'processor':<42} {'rows':>8} {'rows/s':>9} {'peak RSS':>10} {'db size':>9}")
+    try:
+        for rows in options.rows:
+            for layout in options.layouts:
+                path = os.path.join(workdir, f'{layout}-{rows}.csv')
+                WRITERS[layout](path, rows)
+                for processor in LAYOUTS[layout]:
+                    entry = {'layout': layout, 'processor': processor, 'rows': rows,
+                             'file_mb': round(os.path.getsize(path) / 1e6, 2)}
+                    entry.update(measure(processor, path, workdir))
+                    results.append(entry)
+                    print(f"{layout:<18} {processor:<42} {rows:>8} {entry['rows_per_second']:>9} "
+                          f"{entry['peak_rss_mb']:>7.1f} MB {entry['db_mb']:>6.1f} MB")
+                os.remove(path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f'Saved baseline to {options.save}')
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond {options.tolerance:.0%} of {options.compare}')
+
+
+if __name__ == '__main__':
+    main()
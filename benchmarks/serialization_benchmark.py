@@ -0,0 +1,109 @@
+"""
+Time the JSON encoding of GET /api/transactions against a seeded database.
+
+    python benchmarks/serialization_benchmark.py --rows 100000
+
+Compares the original path (sqlite3.Row objects, a dict per row, json.dumps
+with sorted keys) with the batched encoding the API uses now, SQLite's
+json_object() for the objects layout and orjson over row tuples for columns, and the full request with a cold and a warm response cache.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MERCHANTS = ('STARBUCKS #552 SEATTLE WA', 'AMAZON.COM*MK1234', 'SHELL OIL 5739', 'TRADER JOES #123',
+             'NETFLIX.COM', 'UBER *TRIP', 'PAYROLL DEPOSIT', 'CITY WATER UTIL')
+
+
+def seed(rows):
+    from batch_writer import BatchedWriter
+    from database import get_db
+
+    rng = random.Random(42)
+    conn = get_db()
+    try:
+        with BatchedWriter(conn, label='benchmark', dedupe=False, categorize=False) as writer:
+            for index in range(rows):
+                writer.add(f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                           f'{rng.choice(MERCHANTS)} {index}', round(rng.uniform(-250, 250), 2),
+                           rng.choice(('', 'Food', 'Travel', 'Bills')), 'USD', rng.choice(('Checking', 'Card')), '')
+    finally:
+        conn.close()
+
+
+def original_path(database):
+    """What get_transactions did before: Row objects, dicts and jsonify's json.dumps"""
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    rows = [dict(row) for row in conn.execute(
+        "SELECT * FROM transactions ORDER BY IFNULL(date, '') DESC, id DESC")]
+    conn.close()
+    return json.dumps(rows, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def best_of(repeat, function):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='transactions to seed (default 100000)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the best is reported (default 3)')
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='budget-bench-')
+    database = os.path.join(workdir, 'finance.db')
+    os.environ['FINANCE_DB'] = database
+
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    import app
+    client = app.app.test_client()
+    seed(options.rows)
+    from response_cache import response_cache
+    from serialization import dumps, orjson
+
+    def request(url):
+        return client.get(url).get_data()
+
+    def cold_request(url):
+        response_cache.clear()
+        return request(url)
+
+    cases = [
+        ('original: Row dicts + json.dumps', lambda: original_path(database)),
+        ('json_object batches, objects', lambda: dumps(app.query_all_transactions({}))),
+        ('tuple batches, columns', lambda: dumps(app.query_all_transactions({'layout': 'columns'}))),
+        ('GET /api/transactions, cold cache', lambda: cold_request('/api/transactions')),
+        ('GET /api/transactions, warm cache', lambda: request('/api/transactions')),
+    ]
+
+    print(f"{options.rows} rows, encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+    try:
+        baseline = None
+        for label, function in cases:
+            seconds, size = best_of(options.repeat, function)
+            baseline = baseline or seconds
+            print(f'{label:<36} {seconds * 1000:9.1f} ms  {size / 1e6:7.1f} MB  {baseline / seconds:6.1f}x')
+    finally:
+        app.pool.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
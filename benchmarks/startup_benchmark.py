@@ -0,0 +1,77 @@
+"""
+Time a worker's start-up: importing app, building the application and
+serving its first request, each in a fresh interpreter.
+
+    python benchmarks/startup_benchmark.py --runs 10
+
+Every run is a new python process, so nothing is cached in sys.modules.
+The schema bootstrap runs against a database migrated beforehand, as it
+does when a worker starts next to an existing database. Reports the median
+and the slowest run of each phase, and whether pandas was loaded by then.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in each child process; prints the phase times as JSON
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+application.test_client().get('/api/transactions?limit=50')
+served = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'total_ms': (served - start) * 1000,
+    'pandas_loaded': 'pandas' in sys.modules,
+}}))
+'''
+
+PHASES = ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms')
+
+
+def run_child(env):
+    completed = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT)], env=env,
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='fresh processes to time (default 10)')
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='budget-startup-')
+    env = dict(os.environ, FINANCE_DB=os.path.join(workdir, 'finance.db'), LOG_LEVEL='WARNING')
+    try:
+        # The first run creates the schema; it is not counted
+        run_child(env)
+        runs = [run_child(env) for _ in range(options.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f'{options.runs} runs, python {sys.version.split()[0]}')
+    print(f"{'phase':<18} {'median':>10} {'max':>10}")
+    for phase in PHASES:
+        values = [run[phase] for run in runs]
+        print(f'{phase:<18} {statistics.median(values):>7.1f} ms {max(values):>7.1f} ms')
+    print(f"pandas loaded at start-up: {'yes' if any(run['pandas_loaded'] for run in runs) else 'no'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# database.py reads FINANCE_DB when it is first imported, so point it at a
+# scratch file before any test module imports the app
+_workdir = tempfile.mkdtemp(prefix='budget-tests-')
+os.environ['FINANCE_DB'] = os.path.join(_workdir, 'finance.db')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+@pytest.fixture(scope='session', autouse=True)
+def _scratch_database():
+    yield
+    from database import pool
+    pool.close_all()
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture
+def client():
+    """Test client of an app whose database starts out empty"""
+    import app
+    application = app.create_app()
+    test_client = application.test_client()
+    assert test_client.delete('/api/transactions/delete-all').status_code == 200
+    return test_client
+
+
+@pytest.fixture
+def conn(client):
+    from database import get_db
+    connection = get_db()
+    yield connection
+    connection.close()
@@ -0,0 +1,612 @@
+import csv
+import io
+import logging
+import os
+import time
+import warnings
+from datetime import datetime
+
+from batch_writer import BatchedWriter
+from logging_config import row_logger
+from metrics import record_import
+
+# pandas is imported inside the functions that parse files: importing it takes
+# longer than the rest of start-up, and a worker that only serves reads, or a
+# script like migrations.py, never needs it
+
+logger = logging.getLogger(__name__)
+row_log = row_logger(__name__)
+
+# Rows parsed per pandas chunk while streaming a CSV; bounds parse memory regardless of file size
+CSV_CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', '50000'))
+
+# Head of the file read once and shared by every format's matcher
+SAMPLE_BYTES = 64 * 1024
+SAMPLE_ROWS = 50
+
+TRANSACTION_COLUMNS = ['date', 'description', 'amount', 'category', 'currency', 'account', 'memo']
+
+TEXT_FIELDS = ('date', 'description', 'category', 'account', 'memo')
+
+
+def _try_float(value):
+    """Return float(value), or None when float() rejects it"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _coerce_float(values):
+    """
+    Column-wise equivalent of calling float() on every value of a Series.
+    Returns (floats, ok) where ok marks the values float() accepted.
+    """
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float), pd.Series(True, index=values.index)
+
+    floats = pd.to_numeric(values, errors='coerce').astype(float)
+    ok = floats.notna()
+
+    # pandas rejects a few spellings float() accepts ('1_000', 'nan', ...),
+    # so only the leftovers go through the scalar path
+    retry = ~ok & values.notna()
+    if retry.any():
+        fallback = [_try_float(value) for value in values[retry]]
+        floats[retry] = [float('nan') if value is None else value for value in fallback]
+        ok[retry] = [value is not None for value in fallback]
+    return floats, ok
+
+
+def _clean_text_column(values):
+    """Vectorized str(value).strip('"').strip()"""
+    return values.astype(str).str.strip('"').str.strip()
+
+
+def _is_header_row(row):
+    """Whether the first CSV row looks like column names rather than a transaction"""
+    return len(row) > 0 and isinstance(row[0], str) and (
+        'date' in row[0].lower() or
+        'time' in row[0].lower() or
+        (len(row) > 1 and isinstance(row[1], str) and 'description' in row[1].lower()))
+
+
+def _normalize_name(name):
+    return str(name).strip().strip('"').strip().lower()
+
+
+class SignedAmount:
+    """One amount column stored as is: negative for spending, positive for income"""
+
+    def __init__(self, column, strip_separators=False):
+        self.column = column
+        self.strip_separators = strip_separators
+
+    def columns(self):
+        return (self.column,)
+
+    def apply(self, fmt, df):
+        amount, ok = fmt.amount_values(df, self.column, self.strip_separators)
+        return amount, ok, []
+
+
+class DebitCredit:
+    """
+    Separate debit and credit columns; debits are stored negative, credits
+    positive. A row with a debit uses it; with credit_when_debit_invalid an
+    unparseable debit falls back to the credit instead of skipping the row.
+    """
+
+    def __init__(self, debit, credit, credit_when_debit_invalid=False, strip_separators=False):
+        self.debit = debit
+        self.credit = credit
+        self.credit_when_debit_invalid = credit_when_debit_invalid
+        self.strip_separators = strip_separators
+
+    def columns(self):
+        return (self.debit, self.credit)
+
+    def apply(self, fmt, df):
+        debit, debit_ok = fmt.amount_values(df, self.debit, self.strip_separators)
+        credit, credit_ok = fmt.amount_values(df, self.credit, self.strip_separators)
+
+        if self.credit_when_debit_invalid:
+            amount = (-1 * debit).where(debit_ok, credit)
+            keep = debit_ok | credit_ok
+        else:
+            has_debit = fmt.present(df, self.debit, self.strip_separators)
+            amount = (-1 * debit).where(has_debit, credit)
+            keep = (has_debit & debit_ok) | (~has_debit & credit_ok)
+        return amount, keep, []
+
+
+class OutflowInflow:
+    """
+    Outflow and inflow columns written with currency symbols ($1,234.50),
+    stored as outflow minus inflow, so spending is positive. An empty cell
+    counts as zero; a value that is not a number is reported as a row error.
+    """
+
+    def __init__(self, outflow, inflow):
+        self.outflow = outflow
+        self.inflow = inflow
+
+    def columns(self):
+        return (self.outflow, self.inflow)
+
+    def _parse(self, fmt, df, column):
+        import pandas as pd
+
+        values = fmt.column(df, column)
+        if values is None:
+            values = pd.Series('0', index=df.index, dtype=object)
+        missing = values.isna()
+        text = values.fillna('').astype(str).str.strip()
+        text = text.where(text != '', '0').str.replace(r'[^0-9.-]', '', regex=True)
+        text = text.where(text != '', '0')
+        floats, ok = _coerce_float(text)
+        return text, floats, ok & ~missing, missing
+
+    def apply(self, fmt, df):
+        out_text, outflow, out_ok, out_missing = self._parse(fmt, df, self.outflow)
+        in_text, inflow, in_ok, in_missing = self._parse(fmt, df, self.inflow)
+        keep = out_ok & in_ok
+
+        errors = []
+        if not keep.all():
+            for index in keep.index[~keep]:
+                if out_missing[index] or in_missing[index]:
+                    errors.append('Error on row: missing Outflow or Inflow value')
+                    continue
+                value = out_text[index] if not out_ok[index] else in_text[index]
+                try:
+                    float(value)
+                except ValueError as e:
+                    errors.append(f"Error on row: {str(e)}")
+        return outflow - inflow, keep, errors
+
+
+class CsvFormat:
+    """
+    One bank export layout: how to recognise it from the header sample, which
+    column holds each field and how the amount is signed.
+
+    columns maps date/description/category/account/memo to a header name
+    (matched case-insensitively) or, when header=False, a column position.
+    Fields without a column are stored empty. A headered layout matches when
+    every name in required is in the header row; a headerless one when the
+    sample rows have at least min_columns columns and dates in one of
+    date_formats. literal keeps every cell as written, like csv.DictReader,
+    instead of reading empty and "NA"-like cells as missing; clean_text strips
+    stray quotes and spaces from the text fields.
+    """
+
+    def __init__(self, name, amount, columns, header=True, required=(), date_formats=(),
+                 min_columns=0, delimiter=',', literal=False, clean_text=False, description=''):
+        self.name = name
+        self.amount = amount
+        self.columns = columns
+        self.header = header
+        self.required = tuple(_normalize_name(column) for column in required)
+        self.date_formats = tuple(date_formats)
+        self.min_columns = min_columns
+        self.delimiter = delimiter
+        self.literal = literal
+        self.clean_text = clean_text
+        self.description = description
+
+    def __repr__(self):
+        return f'CsvFormat({self.name!r})'
+
+    # Matching
+
+    def matches(self, sample):
+        rows = sample.rows(self.delimiter)
+        if not rows:
+            return False
+        if self.header:
+            header = {_normalize_name(name) for name in rows[0]}
+            return all(name in header for name in self.required)
+
+        data = rows[1:] if _is_header_row(rows[0]) else rows
+        wide = [row for row in data if len(row) >= self.min_columns]
+        if not wide:
+            return False
+        if not self.date_formats:
+            return True
+        dated = sum(1 for row in wide if self.parses_as_date(row[self.columns['date']]))
+        return dated * 2 >= len(wide)
+
+    def parses_as_date(self, value):
+        value = str(value).strip().strip('"').strip()
+        for date_format in self.date_formats:
+            try:
+                datetime.strptime(value, date_format)
+                return True
+            except ValueError:
+                continue
+        return False
+
+    # Reading
+
+    def read_options(self, sample):
+        """pd.read_csv keyword arguments for this layout"""
+        options = {
+            'sep': self.delimiter,
+            'dtype': str,
+            # Rows with a trailing delimiter must not shift the columns
+            'index_col': False,
+        }
+        if self.literal:
+            options['keep_default_na'] = False
+        if self.header:
+            options['header'] = 0
+        else:
+            # Wide enough for every referenced column even if the first rows are short
+            referenced = [column for column in list(self.columns.values()) + list(self.amount.columns())
+                          if isinstance(column, int)]
+            widest = max((len(row) for row in sample.rows(self.delimiter)), default=0)
+            options['header'] = None
+            options['names'] = list(range(max(widest, max(referenced, default=0) + 1)))
+        return options
+
+    def width(self, options, sample):
+        if 'names' in options:
+            return len(options['names'])
+        rows = sample.rows(self.delimiter)
+        return len(rows[0]) if rows else 0
+
+    def prepare(self, df, first):
+        """Normalize a raw chunk: header names lowercased, a header row of a headerless file dropped"""
+        if self.header:
+            df.columns = [_normalize_name(name) for name in df.columns]
+        elif first and df.shape[0] > 0 and df.shape[1] > 1 and _is_header_row([df.iloc[0, 0], df.iloc[0, 1]]):
+            logger.debug("Skipping header row")
+            df = df.iloc[1:]
+        return df
+
+    # Building transactions
+
+    def column(self, df, key):
+        """The Series for a header name or position, None when the file lacks it"""
+        if key is None:
+            return None
+        if self.header:
+            key = _normalize_name(key)
+        if key not in df.columns:
+            return None
+        return df[key]
+
+    def present(self, df, key, strip_separators=False):
+        import pandas as pd
+
+        values = self.column(df, key)
+        if values is None:
+            return pd.Series(False, index=df.index)
+        if strip_separators:
+            return values.notna() & (values.astype(str).str.strip() != '')
+        return values.notna()
+
+    def amount_values(self, df, key, strip_separators=False):
+        """(floats, ok) for an amount column; ok is False where it is empty or not a number"""
+        import pandas as pd
+
+        values = self.column(df, key)
+        if values is None:
+            return pd.Series(float('nan'), index=df.index), pd.Series(False, index=df.index)
+        present = self.present(df, key, strip_separators)
+        if strip_separators:
+            values = _clean_text_column(values).str.replace(',', '', regex=False)
+        floats, ok = _coerce_float(values)
+        return floats, present & ok
+
+    def text_values(self, df, field):
+        import pandas as pd
+
+        values = self.column(df, self.columns.get(field))
+        if values is None:
+            return pd.Series('', index=df.index, dtype=object)
+        if self.clean_text:
+            values = _clean_text_column(values)
+        # Missing cells are stored as NULL
+        return values.astype(object).where(values.notna(), None)
+
+    def transactions(self, df):
+        """
+        (frame, errors): the TRANSACTION_COLUMNS frame of the chunk's valid rows
+        and a message for every row rejected with an error
+        """
+        import pandas as pd
+
+        if df.empty or (not self.header and df.shape[1] < self.min_columns):
+            return pd.DataFrame(columns=TRANSACTION_COLUMNS), []
+
+        amount, keep, errors = self.amount.apply(self, df)
+        frame = pd.DataFrame({field: self.text_values(df, field) for field in TEXT_FIELDS})
+        frame['amount'] = amount
+        frame['currency'] = 'USD'
+        return frame[keep][TRANSACTION_COLUMNS], errors
+
+
+# Formats are tried in registration order; the fallback takes anything else
+FORMATS = []
+_fallback = None
+
+
+def register_format(fmt, fallback=False):
+    """Add a layout to the registry; adding a bank export needs nothing else"""
+    global _fallback
+    if get_format(fmt.name, default=None) is not None:
+        raise ValueError(f'CSV format {fmt.name!r} is already registered')
+    FORMATS.append(fmt)
+    if fallback:
+        _fallback = fmt
+    return fmt
+
+
+def get_format(name, default=KeyError):
+    for fmt in FORMATS:
+        if fmt.name == name:
+            return fmt
+    if default is KeyError:
+        raise KeyError(f'Unknown CSV format: {name}')
+    return default
+
+
+register_format(CsvFormat(
+    'budget',
+    description='Budgeting app export with Outflow/Inflow columns',
+    required=('Outflow', 'Inflow'),
+    columns={'date': 'Date', 'description': 'Payee', 'category': 'Category', 'account': 'Account', 'memo': 'Memo'},
+    amount=OutflowInflow('Outflow', 'Inflow'),
+    date_formats=('%m/%d/%Y', '%Y-%m-%d'),
+    literal=True,
+))
+
+register_format(CsvFormat(
+    'debit_credit',
+    description='Header row with date, description, debit and credit, like sample_transactions.csv',
+    required=('date', 'description', 'debit', 'credit'),
+    columns={'date': 'date', 'description': 'description'},
+    amount=DebitCredit('debit', 'credit'),
+    date_formats=('%Y-%m-%d', '%m/%d/%Y'),
+))
+
+register_format(CsvFormat(
+    'signed_amount',
+    description='Header row with date, description and one signed amount column',
+    required=('date', 'description', 'amount'),
+    columns={'date': 'date', 'description': 'description', 'category': 'category',
+             'account': 'account', 'memo': 'memo'},
+    amount=SignedAmount('amount'),
+    date_formats=('%Y-%m-%d', '%m/%d/%Y'),
+))
+
+register_format(CsvFormat(
+    'account_activity',
+    description='Headerless bank activity export: date, description, debit, credit[, balance]',
+    header=False,
+    columns={'date': 0, 'description': 1},
+    amount=DebitCredit(2, 3, credit_when_debit_invalid=True, strip_separators=True),
+    date_formats=('%m/%d/%Y', '%Y-%m-%d', '%m/%d/%y'),
+    min_columns=3,
+    clean_text=True,
+), fallback=True)
+
+
+class HeaderSample:
+    """The first SAMPLE_BYTES of a file, parsed once and shared by every matcher"""
+
+    def __init__(self, head):
+        self.head = head
+        text = head.decode('utf-8-sig', errors='replace')
+        if len(head) >= SAMPLE_BYTES and '\n' in text:
+            # The last line is probably cut off
+            text = text[:text.rfind('\n') + 1]
+        self.text = text
+        self._rows = {}
+
+    def rows(self, delimiter=','):
+        if delimiter not in self._rows:
+            reader = csv.reader(io.StringIO(self.text), delimiter=delimiter)
+            self._rows[delimiter] = [row for row in reader if row][:SAMPLE_ROWS]
+        return self._rows[delimiter]
+
+
+def sniff_format(sample):
+    """The first registered format matching the sample, else the fallback"""
+    for fmt in FORMATS:
+        if fmt.matches(sample):
+            return fmt
+    logger.info("No CSV format matched the file, using %s", _fallback.name)
+    return _fallback
+
+
+class _ReplayStream(io.RawIOBase):
+    """Serves the already-read head of a stream and then the rest of it, so sniffing costs no second read"""
+
+    def __init__(self, head, rest):
+        self._head = memoryview(head)
+        self._rest = rest
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._head:
+            size = min(len(buffer), len(self._head))
+            buffer[:size] = self._head[:size]
+            self._head = self._head[size:]
+            return size
+        data = self._rest.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class CsvFile:
+    """
+    A CSV being imported from a path or a seekable binary stream. The head is
+    read once for format matching and replayed in front of the rest of the
+    stream, so a well-formed file is read exactly once. Only a file pandas'
+    C parser rejects (rows wider than the header) is read a second time, by
+    the python parser with the extra cells dropped.
+    """
+
+    def __init__(self, source, fmt=None):
+        self.source = source
+        self._owned = None
+        if isinstance(source, (str, bytes, os.PathLike)):
+            self._owned = open(source, 'rb')
+            self.stream = self._owned
+        else:
+            self.stream = source
+            self.stream.seek(0)
+        self.sample = HeaderSample(self.stream.read(SAMPLE_BYTES))
+        self.format = get_format(fmt) if isinstance(fmt, str) else (fmt or sniff_format(self.sample))
+        logger.debug("CSV format: %s", self.format.name)
+
+    def close(self):
+        if self._owned is not None:
+            self._owned.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def _text(self, replay):
+        if replay:
+            raw = io.BufferedReader(_ReplayStream(self.sample.head, self.stream))
+        else:
+            self.stream.seek(0)
+            raw = io.BufferedReader(_ReplayStream(b'', self.stream))
+        return io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+
+    def chunks(self, tolerant=False, chunk_rows=CSV_CHUNK_ROWS):
+        """
+        Yield (frame, rows_read, errors) for every chunk of the file. tolerant
+        re-reads the file from the start with the python parser, truncating
+        rows wider than the layout instead of raising ParserError.
+        """
+        import pandas as pd
+
+        fmt = self.format
+        options = fmt.read_options(self.sample)
+        if tolerant:
+            width = fmt.width(options, self.sample)
+            options.update(engine='python', on_bad_lines=lambda row: row[:width])
+
+        text = self._text(replay=not tolerant)
+        try:
+            with warnings.catch_warnings():
+                # The python parser warns for every truncated row
+                warnings.simplefilter('ignore', pd.errors.ParserWarning)
+                try:
+                    reader = pd.read_csv(text, chunksize=chunk_rows, **options)
+                except pd.errors.EmptyDataError:
+                    return
+                with reader:
+                    for index, df in enumerate(reader):
+                        df = fmt.prepare(df, first=index == 0)
+                        frame, errors = fmt.transactions(df)
+                        yield frame, len(df), errors
+        finally:
+            # Leave the caller's stream open
+            text.detach()
+
+
+def frame_rows(frame):
+    """The rows of a transactions frame as (date, description, amount, ...) tuples"""
+    return zip(*(frame[column].tolist() for column in TRANSACTION_COLUMNS))
+
+
+def import_transactions(conn, source, fmt=None, label=None, progress=None):
+    """
+    Read a CSV and write its transactions through an atomic BatchedWriter,
+    a transaction per chunk, so a file that has to be re-read leaves nothing
+    behind from the first attempt. Returns counts of rows written, duplicates skipped,
+    rows without a valid amount, and the row error messages.
+    """
+    import pandas as pd
+
+    start = time.perf_counter()
+    with CsvFile(source, fmt) as csv_file:
+        for tolerant in (False, True):
+            rows_read = 0
+            errors = []
+            try:
+                with BatchedWriter(conn, label=label or csv_file.format.name, atomic=True,
+                                   progress=progress) as writer:
+                    for frame, read, chunk_errors in csv_file.chunks(tolerant=tolerant):
+                        rows_read += read
+                        errors.extend(chunk_errors)
+                        if chunk_errors and row_log.isEnabledFor(logging.DEBUG):
+                            for message in chunk_errors:
+                                row_log.debug("Rejected row: %s", message)
+                        if not frame.empty:
+                            writer.add_many(frame_rows(frame))
+                break
+            except pd.errors.ParserError as e:
+                if tolerant:
+                    raise
+                logger.warning("Pandas' C parser failed; re-reading with the python parser, "
+                               "dropping cells past the last column", extra={'error': str(e)})
+
+        invalid = rows_read - writer.rows_written - writer.rows_skipped - len(errors)
+        seconds = time.perf_counter() - start
+        record_import(csv_file.format.name, rows_read, writer.rows_written, seconds)
+        # One summary record per import; the rows themselves are only logged at DEBUG
+        logger.info("Imported %d rows as %s", writer.rows_written, csv_file.format.name, extra={
+            'csv_format': csv_file.format.name,
+            'rows_read': rows_read,
+            'rows_written': writer.rows_written,
+            'duplicates': writer.rows_skipped,
+            'invalid': invalid,
+            'errors': len(errors),
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(rows_read / seconds) if seconds > 0 else 0,
+        })
+        return {
+            'format': csv_file.format.name,
+            'rows': writer.rows_written,
+            'duplicates': writer.rows_skipped,
+            'invalid': invalid,
+            'errors': errors,
+        }
+
+
+def parse_file(path, filename=None):
+    """
+    Parse a whole CSV into transaction tuples without touching the database.
+    Runs in the batch upload's parse workers, so everything it returns must
+    be picklable. parse_cpu_seconds is the worker's CPU time for this file,
+    which does not grow while the worker waits for a CPU.
+    """
+    import pandas as pd
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    with CsvFile(path) as csv_file:
+        for tolerant in (False, True):
+            rows = []
+            errors = []
+            try:
+                for frame, read, chunk_errors in csv_file.chunks(tolerant=tolerant):
+                    errors.extend(chunk_errors)
+                    rows.extend(frame_rows(frame))
+                break
+            except pd.errors.ParserError:
+                if tolerant:
+                    raise
+        return {
+            'filename': filename or os.path.basename(path),
+            'processor': csv_file.format.name,
+            'rows': rows,
+            'errors': errors,
+            'parse_seconds': time.perf_counter() - start,
+            'parse_cpu_seconds': time.process_time() - cpu_start,
+        }
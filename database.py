@@ -0,0 +1,256 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from metrics import observe_sql
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DATABASE = os.environ.get('FINANCE_DB', 'finance.db')
+
+# Idle connections kept per worker process; extra ones are closed when released
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+
+# How long a writer waits for the lock before raising "database is locked"
+BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000'))
+
+# Columns of transactions the API returns and exports, as a SELECT list. The
+# fingerprint, rule_id, merchant, amount_cents and seq columns are internal.
+TRANSACTION_FIELDS = 'id, date, description, amount, category, custom_category, currency, account, memo'
+
+# Applied to every new connection. WAL lets readers keep reading while an
+# import writes, and synchronous=NORMAL is crash-safe in WAL mode while
+# skipping the fsync on every commit.
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}',
+    'PRAGMA cache_size = -16000',  # 16 MB page cache per connection
+    'PRAGMA mmap_size = 268435456',  # memory-map up to 256 MB of the file for reads
+    'PRAGMA temp_store = MEMORY',
+)
+
+
+def json_real(value):
+    """
+    JSON text of a REAL as serialization.dumps() writes it, for the floats
+    that need more than the 15 significant digits json_object() prints
+    (0.1 + 0.2, say). Registered on every pooled connection.
+    """
+    if orjson is not None:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value)
+
+
+class TimedCursor:
+    """A sqlite3 cursor whose execute calls are timed for the SQL metrics"""
+
+    __slots__ = ('_cursor',)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            self._cursor.execute(sql, parameters)
+        finally:
+            observe_sql(sql, time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq_of_parameters)
+        finally:
+            observe_sql(sql, time.perf_counter() - start)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PooledConnection:
+    """
+    A sqlite3 connection borrowed from a ConnectionPool. Everything is
+    forwarded to the real connection except close(), which hands it back
+    to the pool (rolling back anything left uncommitted), and the execute
+    calls, which are timed for /api/metrics. Time spent fetching rows after
+    a SELECT's first one is not counted.
+    """
+
+    __slots__ = ('_pool', '_conn')
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+
+    def _connection(self):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return self._conn
+
+    def __getattr__(self, name):
+        return getattr(self._connection(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._connection(), name, value)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return self._connection().execute(sql, parameters)
+        finally:
+            observe_sql(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return self._connection().executemany(sql, seq_of_parameters)
+        finally:
+            observe_sql(sql, time.perf_counter() - start)
+
+    def cursor(self):
+        return TimedCursor(self._connection().cursor())
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            self._connection().commit()
+        finally:
+            observe_sql('COMMIT', time.perf_counter() - start)
+
+    def __enter__(self):
+        return self._connection().__enter__()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return self._connection().__exit__(exc_type, exc_value, tb)
+
+    def close(self):
+        conn = self._conn
+        if conn is not None:
+            object.__setattr__(self, '_conn', None)
+            self._pool._release(conn)
+
+    def __del__(self):
+        # A handler that forgot close() still returns its connection
+        self.close()
+
+
+class ConnectionPool:
+    """Long-lived SQLite connections shared by the threads of one worker"""
+
+    def __init__(self, database=DATABASE, size=POOL_SIZE):
+        self.database = database
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.RLock()
+        self._opened = 0
+        self._closed = 0
+        self._checkouts = 0
+        self._reused = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+
+    def _open(self):
+        conn = sqlite3.connect(self.database, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        conn.create_function('json_real', 1, json_real, deterministic=True)
+        return conn
+
+    def connect(self):
+        """Borrow a connection; call close() on it to give it back"""
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = self._open()
+            reused = False
+
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            if reused:
+                self._reused += 1
+            else:
+                self._opened += 1
+        return PooledConnection(self, conn)
+
+    def _release(self, conn):
+        keep = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            keep = False
+
+        with self._lock:
+            self._in_use -= 1
+            keep = keep and self._idle.qsize() < self.size
+            if not keep:
+                self._closed += 1
+
+        if keep:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def close_all(self):
+        """Close every idle connection, e.g. before deleting the database file"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._closed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'database': self.database,
+                'pool_size': self.size,
+                'idle': self._idle.qsize(),
+                'in_use': self._in_use,
+                'peak_in_use': self._peak_in_use,
+                'opened': self._opened,
+                'closed': self._closed,
+                'checkouts': self._checkouts,
+                'reused': self._reused,
+                'reuse_ratio': round(self._reused / self._checkouts, 4) if self._checkouts else 0.0,
+            }
+
+
+pool = ConnectionPool()
+
+
+def get_db():
+    """Borrow a connection from the worker's pool"""
+    return pool.connect()
+
+
+def data_version(conn):
+    """
+    Counter bumped by every write to the transactions table, so readers can
+    tell whether anything changed since they last looked (see
+    bump_data_version). Shared by every worker through the database.
+    """
+    row = conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()
+    return row[0] if row else 0
+
+
+def bump_data_version(conn):
+    """Call in the write transaction that changes transactions, before it commits"""
+    conn.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
@@ -2,12 +2,19 @@ import React, { useState } from 'react';
 import axios from 'axios';
 import '../App.css';
 
+// How often a running import is polled, in milliseconds
+const IMPORT_POLL_INTERVAL = 1000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
 const CSVUpload = ({ onSuccess }) => {
   const [selectedFile, setSelectedFile] = useState(null);
   const [isUploading, setIsUploading] = useState(false);
   const [error, setError] = useState(null);
   const [debugInfo, setDebugInfo] = useState(null);
   const [uploadResult, setUploadResult] = useState(null);
+  const [replaceExisting, setReplaceExisting] = useState(false);
+  const [importProgress, setImportProgress] = useState(null);
 
   const handleFileChange = (e) => {
     setSelectedFile(e.target.files[0]);
@@ -26,6 +33,7 @@ const CSVUpload = ({ onSuccess }) => {
     setError(null);
     setDebugInfo(null);
     setUploadResult(null);
+    setImportProgress(null);
     
     // Debug info about the file
     const fileInfo = {
@@ -39,19 +47,38 @@ const CSVUpload = ({ onSuccess }) => {
     
     const formData = new FormData();
     formData.append('file', selectedFile);
+    formData.append('mode', replaceExisting ? 'replace' : 'merge');
 
     try {
-      console.log('Making POST request to /api/upload-csv');
-      const response = await axios.post('/api/upload-csv', formData, {
+      // The server queues the import and answers at once; poll the job until it finishes
+      console.log('Making POST request to /api/imports');
+      const response = await axios.post('/api/imports', formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
         },
       });
       
-      console.log('Upload successful:', response.data);
+      let job = response.data;
+      setImportProgress(job);
+      while (job.status === 'queued' || job.status === 'running') {
+        await sleep(IMPORT_POLL_INTERVAL);
+        job = (await axios.get(job.status_url || `/api/imports/${job.id}`)).data;
+        setImportProgress(job);
+      }
+      
+      if (job.status === 'failed') {
+        setIsUploading(false);
+        setImportProgress(null);
+        setError(job.errors.length ? job.errors[job.errors.length - 1] : 'Import failed.');
+        setDebugInfo(`Import job: ${JSON.stringify(job)}`);
+        return;
+      }
+      
+      console.log('Import finished:', job);
       setIsUploading(false);
+      setImportProgress(null);
       setSelectedFile(null);
-      setUploadResult(response.data.message);
+      setUploadResult(job.message);
       
       // Reset the file input
       const fileInput = document.getElementById('csv-file-input');
@@ -62,6 +89,7 @@ const CSVUpload = ({ onSuccess }) => {
       
     } catch (err) {
       setIsUploading(false);
+      setImportProgress(null);
       
       console.error('Upload error:', err);
       
@@ -98,6 +126,7 @@ const CSVUpload = ({ onSuccess }) => {
       console.log('Using example file');
       const formData = new FormData();
       formData.append('use_example', 'true');
+      formData.append('mode', replaceExisting ? 'replace' : 'merge');
       
       const response = await axios.post('/api/process-example', formData);
       
@@ -159,13 +188,27 @@ const CSVUpload = ({ onSuccess }) => {
           />
         </div>
         
+        <div className="form-check mb-3">
+          <input
+            type="checkbox"
+            className="form-check-input"
+            id="replace-existing-input"
+            checked={replaceExisting}
+            onChange={(e) => setReplaceExisting(e.target.checked)}
+            disabled={isUploading}
+          />
+          <label htmlFor="replace-existing-input" className="form-check-label">
+            Replace existing transactions (otherwise only new rows are added and your edits are kept)
+          </label>
+        </div>
+        
         <div className="d-flex gap-2 mb-3">
           <button 
             className="btn btn-primary" 
             onClick={handleUpload} 
             disabled={!selectedFile || isUploading}
           >
-            {isUploading ? 'Uploading...' : 'Upload File'}
+            {isUploading ? (importProgress ? 'Importing...' : 'Uploading...') : 'Upload File'}
           </button>
           
           <button 
@@ -178,6 +221,31 @@ const CSVUpload = ({ onSuccess }) => {
         </div>
       </div>
       
+      {importProgress && (
+        <div className="import-progress mb-3">
+          <div className="progress mb-1">
+            <div
+              className="progress-bar"
+              role="progressbar"
+              style={{ width: `${importProgress.percent}%` }}
+              aria-valuenow={importProgress.percent}
+              aria-valuemin="0"
+              aria-valuemax="100"
+            >
+              {importProgress.percent}%
+            </div>
+          </div>
+          <small className="text-muted">
+            {importProgress.status === 'queued'
+              ? 'Waiting for other imports to finish...'
+              : `${importProgress.rows.toLocaleString()} rows imported` +
+                (importProgress.duplicates ? `, ${importProgress.duplicates.toLocaleString()} already imported` : '') +
+                ` (${Math.round(importProgress.rows_per_second).toLocaleString()} rows/s` +
+                (importProgress.eta_seconds != null ? `, about ${Math.ceil(importProgress.eta_seconds)}s left)` : ')')}
+          </small>
+        </div>
+      )}
+      
       {uploadResult && (
         <div className="alert alert-success">
           <strong>Success!</strong> {uploadResult}
@@ -0,0 +1,171 @@
+import datetime
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Imports run at the same time; the rest wait in the queue. Running imports
+# parse side by side and take turns writing chunks (see batch_writer.py).
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', '2'))
+
+# Jobs waiting or running before new uploads are turned away
+IMPORT_QUEUE_SIZE = int(os.environ.get('IMPORT_QUEUE_SIZE', '20'))
+
+# Finished jobs kept around for polling
+IMPORT_JOB_HISTORY = 100
+
+# Row error messages kept per job
+MAX_JOB_ERRORS = 100
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+class ImportJob:
+    """
+    State of one background CSV import. The worker thread updates it through
+    progress(); the API reads it with snapshot().
+    """
+
+    def __init__(self, filename, mode, source, bytes_total):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.mode = mode
+        self.source = source
+        self.bytes_total = bytes_total
+        self.bytes_done = 0
+        self.status = 'queued'
+        self.processor = None
+        self.rows = 0
+        self.duplicates = 0
+        self.errors = []
+        self.message = None
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self._started = None
+        self._finished = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.status in ('succeeded', 'failed')
+
+    def start(self):
+        with self._lock:
+            self.status = 'running'
+            self.started_at = _now()
+            self._started = time.perf_counter()
+
+    def progress(self, rows, duplicates):
+        """BatchedWriter callback after every chunk, on the worker thread"""
+        try:
+            position = self.source.tell()
+        except (OSError, ValueError):
+            position = None
+        with self._lock:
+            self.rows = rows
+            self.duplicates = duplicates
+            if position is not None:
+                self.bytes_done = min(position, self.bytes_total)
+
+    def add_errors(self, errors):
+        with self._lock:
+            self.errors.extend(errors[:MAX_JOB_ERRORS - len(self.errors)])
+
+    def finish(self, message=None, error=None):
+        with self._lock:
+            self.status = 'failed' if error else 'succeeded'
+            self.message = message
+            if error:
+                self.errors.append(error)
+            else:
+                self.bytes_done = self.bytes_total
+            self.finished_at = _now()
+            self._finished = time.perf_counter()
+
+    def snapshot(self):
+        with self._lock:
+            if self._started is None:
+                elapsed = 0.0
+            else:
+                elapsed = (self._finished or time.perf_counter()) - self._started
+
+            rows_per_second = (self.rows + self.duplicates) / elapsed if elapsed > 0 else 0.0
+            fraction = self.bytes_done / self.bytes_total if self.bytes_total else 0.0
+
+            # The position is how far the parser has read, which runs up to one
+            # parse chunk ahead of the rows written, so a running job whose
+            # input is fully read has an unknown ETA rather than zero
+            eta_seconds = None
+            if self.done:
+                eta_seconds = 0.0
+            elif self.status == 'running':
+                fraction = min(fraction, 0.999)
+                if 0 < fraction < 0.999:
+                    eta_seconds = round(elapsed * (1 - fraction) / fraction, 1)
+
+            return {
+                'id': self.id,
+                'filename': self.filename,
+                'mode': self.mode,
+                'status': self.status,
+                'processor': self.processor,
+                'rows': self.rows,
+                'duplicates': self.duplicates,
+                'errors': list(self.errors),
+                'message': self.message,
+                'bytes_total': self.bytes_total,
+                'bytes_processed': self.bytes_done,
+                'percent': round(fraction * 100, 1),
+                'rows_per_second': round(rows_per_second, 1),
+                'elapsed_seconds': round(elapsed, 3),
+                'eta_seconds': eta_seconds,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+
+
+class QueueFull(Exception):
+    pass
+
+
+class ImportQueue:
+    """Bounded pool of import threads plus the registry of recent jobs"""
+
+    def __init__(self, workers=IMPORT_WORKERS, max_pending=IMPORT_QUEUE_SIZE):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, job, run):
+        """Queue run(job) on the pool; raises QueueFull when too many jobs are pending"""
+        with self._lock:
+            pending = sum(1 for queued in self._jobs.values() if not queued.done)
+            if pending >= self.max_pending:
+                raise QueueFull(f'{pending} imports are already queued or running')
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(run, job)
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - IMPORT_JOB_HISTORY)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+
+import_queue = ImportQueue()
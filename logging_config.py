@@ -0,0 +1,141 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# DEBUG adds per-chunk and (sampled) per-row import diagnostics
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+# 'text' for people, 'json' for one object per line for log collectors
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+
+# Per-row diagnostics pass at most this many records of one message per window
+ROW_LOG_LIMIT = int(os.environ.get('ROW_LOG_LIMIT', '20'))
+ROW_LOG_WINDOW_SECONDS = 10.0
+
+# Attributes every LogRecord has; anything else was passed in extra= and is a field of the record
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and the extra= fields"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The usual one-line format with the extra= fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            extra = ' '.join(f'{key}={value}' for key, value in fields.items())
+            line, _, trace = line.partition('\n')
+            line = f'{line} {extra}' + (f'\n{trace}' if trace else '')
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most limit records with the same message template per
+    window. The first record after a window that dropped some carries a
+    suppressed=N field, so the volume is still visible.
+    """
+
+    def __init__(self, limit=ROW_LOG_LIMIT, window=ROW_LOG_WINDOW_SECONDS):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        now = time.monotonic()
+        with self._lock:
+            started, passed, suppressed = self._counts.get(record.msg, (now, 0, 0))
+            if now - started >= self.window:
+                started, passed = now, 0
+            if passed >= self.limit:
+                self._counts[record.msg] = (started, passed, suppressed + 1)
+                return False
+            self._counts[record.msg] = (started, passed + 1, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queues records with their arguments merged into the message and the traceback as text"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def row_logger(name):
+    """
+    Logger for per-row diagnostics of module name, e.g. rejected rows. It
+    logs at DEBUG and is rate limited, so a bad file cannot flood the log.
+    Check isEnabledFor(logging.DEBUG) before building a record in a loop.
+    """
+    logger = logging.getLogger(f'{name}.rows')
+    if not any(isinstance(existing, RateLimitFilter) for existing in logger.filters):
+        logger.addFilter(RateLimitFilter())
+    return logger
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, stream=None):
+    """
+    Send every record through a queue to a background thread that formats
+    and writes it, so request and import threads never wait on stderr.
+    Safe to call more than once; only the first call configures.
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+
+        records = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_QueueHandler(records))
+
+        _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+        _listener.start()
+        # Flush what is still queued when the process exits
+        atexit.register(_listener.stop)
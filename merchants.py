@@ -0,0 +1,78 @@
+import os
+import re
+from functools import lru_cache
+
+# Distinct raw descriptions whose canonical merchant is remembered per process
+MERCHANT_CACHE_SIZE = int(os.environ.get('MERCHANT_CACHE_SIZE', '16384'))
+
+# Canonical names longer than this are cut, so the key stays short to index and group by
+MAX_MERCHANT_LENGTH = 64
+
+# Card network and bank wording put in front of the merchant, e.g. "POS PURCHASE".
+# "AUTHORIZED ON" comes before the date of the authorization: "AUTHORIZED ON 04/12".
+PREFIX_WORDS = (r'POS|DEBIT|CREDIT|CARD|VISA|MC|CHECKCARD|CHECK CARD|PURCHASE|RECURRING|'
+                r'(?:PRE)?AUTHORIZED ON|PREAUTHORIZED|AUTHORIZED|ACH|ONLINE')
+
+# Payment processor marks, e.g. "SQ *", "TST* ", or the bare code in front of
+# a one-word name that a '*' ends, as in "DD DOORDASH*CHIPOTLE"
+PROCESSOR_PREFIX = r'(?:SQ|TST|SP|PP|PAYPAL|IN|DD|BT|PY|EB)(?:\s?\*\s*|\s(?=[^\s*]+ \* ))'
+
+# Card number, masked card number or date, e.g. "0412", "XXXX1234", "04/12".
+# A shorter number only counts after another prefix; at the start it begins
+# a name like "7 ELEVEN".
+NUMBER_PREFIX = r'(?:X+\d[\d/-]*|\d[\d/-]{2,}|(?<=\s)\d+)\s+'
+
+NAME_WORD = r"[A-Z][A-Z&'.-]*(?:\s|$)"
+
+# A prefix word can be part of the name too ("MC DONALDS", "CARD FACTORY"), so
+# a run of them is only removed in front of a processor mark, a number or
+# reference, or at least two more words that do not start with a prefix word.
+# "CREDIT CARD PAYMENT" keeps CREDIT, as CARD PAYMENT would be no name either.
+PREFIX_PATTERN = re.compile(
+    rf'^(?:(?:{PREFIX_WORDS})\b[\s:-]*'
+    rf'(?=(?:(?:{PREFIX_WORDS})\b[\s:-]*)*'
+    rf'(?:{PROCESSOR_PREFIX}|[#\d]|X{{2,}}|(?!(?:{PREFIX_WORDS})\b){NAME_WORD}{NAME_WORD}))'
+    rf'|{PROCESSOR_PREFIX}|{NUMBER_PREFIX})+'
+)
+
+# First token carrying a store number, date, reference or phone number; the
+# merchant name ends before it
+DETAIL_PATTERN = re.compile(r'\s(?:#|\S*\d|X{2,})')
+
+# Two-letter state or province code at the end, e.g. "... SEATTLE WA"
+REGION_PATTERN = re.compile(r'\s[A-Z]{2}$')
+
+NON_NAME_PATTERN = re.compile(r"[^A-Z0-9&'.#*\s-]+")
+SPACE_PATTERN = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=MERCHANT_CACHE_SIZE)
+def canonical_merchant(description):
+    """
+    Short grouping key for the merchant of a raw bank description:
+    'POS PURCHASE 1234 STARBUCKS #552 SEATTLE WA' -> 'STARBUCKS'.
+    Returns '' for an empty description. Cached, because the same few
+    merchants repeat throughout an export; see canonical_merchant.cache_info().
+    """
+    if not description:
+        return ''
+    # A '*' often separates the merchant from an order reference: AMAZON.COM*MK1234
+    text = NON_NAME_PATTERN.sub(' ', str(description).upper()).replace('*', ' * ')
+    text = SPACE_PATTERN.sub(' ', text).strip()
+    raw = text
+
+    text = PREFIX_PATTERN.sub('', text)
+    star = text.find(' * ')
+    if star > 0:
+        text = text[:star]
+    detail = DETAIL_PATTERN.search(text)
+    if detail:
+        text = text[:detail.start()]
+    if ' ' in text:
+        text = REGION_PATTERN.sub('', text)
+    text = text.strip(" .'&#*")
+
+    # Nothing recognisable as a name, e.g. a description that is only a reference number
+    if not text:
+        text = raw
+    return text[:MAX_MERCHANT_LENGTH].rstrip()
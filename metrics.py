@@ -0,0 +1,155 @@
+import threading
+from bisect import bisect_left
+
+# Every metric name starts with this, so they are easy to find in Prometheus
+PREFIX = 'budgetapp_'
+
+# Upper bounds (seconds) of the latency histograms' buckets
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+
+# Statement kinds SQL time is broken down by; anything else counts as OTHER
+SQL_STATEMENT_KINDS = frozenset(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'BEGIN', 'COMMIT', 'PRAGMA', 'CREATE'))
+
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f'{self.name}{_label_text(self.labels, key)} {_number(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """
+    Counts per bucket plus the sum, per label set. observe() is a bisect and
+    two additions under a lock, cheap enough for every request and query.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # One slot per bucket, then the sum
+                series = self._values[labels] = [0] * len(self.buckets) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = sorted((key, list(series)) for key, series in self._values.items())
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_label_text(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_label_text(self.labels, key)} {_number(series[-1])}')
+            lines.append(f'{self.name}_count{_label_text(self.labels, key)} {cumulative}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to handle a request, by route',
+                            ('method', 'route', 'status'))
+RESPONSE_BYTES = Counter('http_response_bytes_total', 'Response body bytes sent, by route', ('method', 'route'))
+SQL_SECONDS = Histogram('sql_statement_duration_seconds', 'Time SQLite spent executing statements, by kind',
+                        ('statement',), buckets=SQL_BUCKETS)
+IMPORT_ROWS_PARSED = Counter('import_rows_parsed_total', 'CSV rows read by imports, by format', ('format',))
+IMPORT_ROWS_INSERTED = Counter('import_rows_inserted_total', 'Transactions stored by imports, by format', ('format',))
+IMPORT_SECONDS = Counter('import_seconds_total', 'Wall time spent importing, by format', ('format',))
+IMPORT_PARSE_RATE = Gauge('import_rows_parsed_per_second', 'Rows read per second by the last import of each format',
+                          ('format',))
+IMPORT_INSERT_RATE = Gauge('import_rows_inserted_per_second',
+                           'Transactions stored per second by the last import of each format', ('format',))
+
+
+def statement_kind(sql):
+    words = sql.lstrip()[:7].split(None, 1)
+    kind = words[0].upper() if words else ''
+    return kind if kind in SQL_STATEMENT_KINDS else 'OTHER'
+
+
+def observe_sql(sql, seconds):
+    SQL_SECONDS.observe((statement_kind(sql),), seconds)
+
+
+def record_import(format_name, rows_parsed, rows_inserted, seconds):
+    """Count one finished import; its rates are per second of wall time"""
+    labels = (format_name,)
+    IMPORT_ROWS_PARSED.inc(labels, rows_parsed)
+    IMPORT_ROWS_INSERTED.inc(labels, rows_inserted)
+    IMPORT_SECONDS.inc(labels, seconds)
+    if seconds > 0:
+        IMPORT_PARSE_RATE.set(labels, rows_parsed / seconds)
+        IMPORT_INSERT_RATE.set(labels, rows_inserted / seconds)
+
+
+def sample_lines(name, kind, help, value):
+    """Exposition lines for a value read at scrape time, e.g. from pool.stats()"""
+    return [f'# HELP {PREFIX}{name} {help}', f'# TYPE {PREFIX}{name} {kind}', f'{PREFIX}{name} {_number(value)}']
+
+
+def render(extra_lines=()):
+    """Every metric of this process in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,473 @@
+import datetime
+import logging
+import threading
+import time
+from batch_writer import amount_cents, normalize_date, transaction_fingerprint
+from merchants import canonical_merchant
+from database import bump_data_version, get_db, BUSY_TIMEOUT_MS
+from rollups import ROLLUP_COLUMNS, ROLLUP_DIMENSIONS, add_to_rollups, clear_rollups
+
+logger = logging.getLogger(__name__)
+
+# Workers starting while another one builds an index wait this long for the write lock
+MIGRATION_BUSY_TIMEOUT_MS = 10 * 60 * 1000
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _create_transactions_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id TEXT PRIMARY KEY,
+        date TEXT,
+        description TEXT,
+        amount REAL,
+        category TEXT,
+        custom_category TEXT,
+        currency TEXT DEFAULT 'USD',
+        account TEXT,
+        memo TEXT
+    )
+    ''')
+
+
+def _add_currency_account_memo(conn):
+    """Databases created before these columns existed need them added"""
+    columns = [column[1] for column in conn.execute('PRAGMA table_info(transactions)')]
+    if 'currency' not in columns:
+        conn.execute("ALTER TABLE transactions ADD COLUMN currency TEXT DEFAULT 'USD'")
+    if 'account' not in columns:
+        conn.execute('ALTER TABLE transactions ADD COLUMN account TEXT')
+    if 'memo' not in columns:
+        conn.execute('ALTER TABLE transactions ADD COLUMN memo TEXT')
+
+
+def _create_sort_indexes(conn):
+    # These expressions must match TRANSACTION_SORT_KEYS in app.py exactly,
+    # otherwise SQLite will not use the indexes for ORDER BY
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date_id "
+                 "ON transactions (IFNULL(date, ''), id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_amount_id "
+                 "ON transactions (IFNULL(amount, 0), id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_description_id "
+                 "ON transactions (IFNULL(description, ''), id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_category_id "
+                 "ON transactions (COALESCE(NULLIF(custom_category, ''), NULLIF(category, ''), ''), id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_category_date_id "
+                 "ON transactions (COALESCE(NULLIF(custom_category, ''), NULLIF(category, ''), ''), "
+                 "IFNULL(date, ''), id)")
+
+
+def _create_filter_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_account_date ON transactions (account, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_category_date ON transactions (category, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_currency_date ON transactions (currency, date)')
+
+
+def _add_fingerprints(conn):
+    """Fingerprint column used by merge imports to skip rows already stored, backfilled for existing rows"""
+    columns = [column[1] for column in conn.execute('PRAGMA table_info(transactions)')]
+    if 'fingerprint' not in columns:
+        conn.execute('ALTER TABLE transactions ADD COLUMN fingerprint TEXT')
+
+    # Walk the table in rowid ranges rather than updating rows under an open SELECT
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            'SELECT rowid, date, description, amount, account FROM transactions '
+            'WHERE rowid > ? ORDER BY rowid LIMIT 5000',
+            (last_rowid,)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            'UPDATE transactions SET fingerprint = ? WHERE rowid = ?',
+            [(transaction_fingerprint(date, description, amount, account), rowid)
+             for rowid, date, description, amount, account in rows]
+        )
+        last_rowid = rows[-1][0]
+
+    # Not unique: identical rows within one export are legitimate
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_fingerprint ON transactions (fingerprint)')
+
+
+def _create_summary_index(conn):
+    # Covers the summary API's GROUP BY (ROLLUP_DIMENSIONS in rollups.py, in
+    # the same order) so totals are computed from the index alone. The month and
+    # category expressions must match MONTH_SQL and EFFECTIVE_CATEGORY_SQL exactly.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transactions_summary ON transactions ("
+        "CASE WHEN date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' THEN substr(date, 1, 7) "
+        "WHEN date GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*' "
+        "THEN substr(date, 7, 4) || '-' || substr(date, 1, 2) "
+        "ELSE '' END, "
+        "COALESCE(NULLIF(custom_category, ''), NULLIF(category, ''), ''), "
+        "IFNULL(account, ''), IFNULL(currency, ''), amount)"
+    )
+
+
+def _create_monthly_rollups(conn):
+    """Per (month, category, account, currency) totals kept up to date by every write, see rollups.py"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS monthly_rollups (
+        month TEXT NOT NULL,
+        category TEXT NOT NULL,
+        account TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        total_cents INTEGER NOT NULL,
+        income_cents INTEGER NOT NULL,
+        expense_cents INTEGER NOT NULL,
+        PRIMARY KEY (month, category, account, currency)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('DELETE FROM monthly_rollups')
+    # Filled the way add_to_rollups did when this step shipped, from the REAL
+    # amount: amount_cents only exists from migration 11, which rebuilds them
+    keys = ', '.join(ROLLUP_DIMENSIONS.values())
+    cents = 'CAST(ROUND(amount * 100) AS INTEGER)'
+    conn.execute(
+        f"INSERT INTO monthly_rollups ({', '.join(ROLLUP_COLUMNS)}) "
+        f'SELECT {keys}, COUNT(*), IFNULL(SUM({cents}), 0), '
+        f'IFNULL(SUM(CASE WHEN amount > 0 THEN {cents} END), 0), '
+        f'IFNULL(SUM(CASE WHEN amount < 0 THEN {cents} END), 0) '
+        f'FROM transactions GROUP BY {keys}'
+    )
+
+
+def _create_search_index(conn):
+    # External content table: it stores only the tokens and reads the text
+    # from transactions. Imports and edits keep it in sync, see search.py.
+    # The prefix indexes make typeahead on 2 to 4 letters fast.
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5("
+        "description, memo, content='transactions', content_rowid='rowid', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"
+    )
+    conn.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+
+
+def _create_categorization_rules(conn):
+    """Rules that categorize imported rows; rule_id records which rule set a row's category"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS categorization_rules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        match_type TEXT NOT NULL DEFAULT 'contains',
+        pattern TEXT,
+        min_amount REAL,
+        max_amount REAL,
+        category TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        enabled INTEGER NOT NULL DEFAULT 1,
+        created_at TEXT
+    )
+    ''')
+    columns = [column[1] for column in conn.execute('PRAGMA table_info(transactions)')]
+    if 'rule_id' not in columns:
+        conn.execute('ALTER TABLE transactions ADD COLUMN rule_id INTEGER')
+
+
+def _add_merchants(conn):
+    """Canonical merchant of every description, backfilled for existing rows"""
+    columns = [column[1] for column in conn.execute('PRAGMA table_info(transactions)')]
+    if 'merchant' not in columns:
+        conn.execute('ALTER TABLE transactions ADD COLUMN merchant TEXT')
+
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            'SELECT rowid, description FROM transactions WHERE rowid > ? ORDER BY rowid LIMIT 5000',
+            (last_rowid,)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            'UPDATE transactions SET merchant = ? WHERE rowid = ?',
+            [(canonical_merchant(description), rowid) for rowid, description in rows]
+        )
+        last_rowid = rows[-1][0]
+
+    # Covers merchant filters and per-merchant totals
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_merchant ON transactions (merchant, amount)')
+
+
+def _add_typed_dates_and_cents(conn):
+    """
+    ISO dates and integer-cent amounts for existing rows, matching what
+    imports now store. Fingerprints are recomputed from the ISO date so
+    re-imports of old files still deduplicate, and the rollups and the
+    summary and merchant indexes move over to amount_cents.
+    """
+    columns = [column[1] for column in conn.execute('PRAGMA table_info(transactions)')]
+    if 'amount_cents' not in columns:
+        conn.execute('ALTER TABLE transactions ADD COLUMN amount_cents INTEGER')
+
+    # Both are rebuilt below; dropping them first saves updating them row by row
+    conn.execute('DROP INDEX IF EXISTS idx_transactions_summary')
+    conn.execute('DROP INDEX IF EXISTS idx_transactions_merchant')
+
+    conn.create_function('to_cents', 1, amount_cents, deterministic=True)
+    conn.execute('UPDATE transactions SET amount_cents = to_cents(amount)')
+
+    # Only dates not already in ISO form need rewriting, along with their fingerprint
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            'SELECT rowid, date, description, amount, account FROM transactions '
+            "WHERE rowid > ? AND date NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' "
+            'ORDER BY rowid LIMIT 5000',
+            (last_rowid,)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for rowid, date, description, amount, account in rows:
+            date = normalize_date(date)
+            updates.append((date, transaction_fingerprint(date, description, amount, account), rowid))
+        conn.executemany('UPDATE transactions SET date = ?, fingerprint = ? WHERE rowid = ?', updates)
+        last_rowid = rows[-1][0]
+
+    # Migration 7 summed the REAL amount; from here on the rollups sum amount_cents
+    clear_rollups(conn)
+    add_to_rollups(conn)
+
+    # Same keys as migrations 6 and 10, now covering the cents the totals sum
+    conn.execute(
+        "CREATE INDEX idx_transactions_summary ON transactions ("
+        "CASE WHEN date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' THEN substr(date, 1, 7) "
+        "WHEN date GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*' "
+        "THEN substr(date, 7, 4) || '-' || substr(date, 1, 2) "
+        "ELSE '' END, "
+        "COALESCE(NULLIF(custom_category, ''), NULLIF(category, ''), ''), "
+        "IFNULL(account, ''), IFNULL(currency, ''), amount_cents)"
+    )
+    conn.execute('CREATE INDEX idx_transactions_merchant ON transactions (merchant, amount_cents)')
+
+
+def _create_data_version(conn):
+    """Single-row write counter behind the API's ETags, see data_version in database.py"""
+    conn.execute('CREATE TABLE IF NOT EXISTS data_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)')
+    # Start from the clock, so a database recreated from scratch never hands
+    # out a version (and ETag) an earlier one already used
+    conn.execute(
+        'INSERT OR IGNORE INTO data_version (id, version) '
+        "VALUES (1, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))"
+    )
+
+
+def _drop_unused_filter_indexes(conn):
+    """
+    No query uses these: the account and currency filters match with
+    LIKE '%...%', the category filter is on the effective category served by
+    idx_transactions_category_date_id, and the date bounds are on the date
+    sort key served by idx_transactions_date_id. They only slowed down writes.
+    """
+    conn.execute('DROP INDEX IF EXISTS idx_transactions_date')
+    conn.execute('DROP INDEX IF EXISTS idx_transactions_account_date')
+    conn.execute('DROP INDEX IF EXISTS idx_transactions_category_date')
+    conn.execute('DROP INDEX IF EXISTS idx_transactions_currency_date')
+
+
+def _recompute_merchants(conn):
+    """
+    Canonical merchants under the current rules: names are cut at a '*', and
+    prefix words that are part of the name ("MC DONALDS") are kept. Run
+    again as a new step whenever canonical_merchant() changes.
+    """
+    last_rowid = 0
+    changed = 0
+    while True:
+        rows = conn.execute(
+            'SELECT rowid, description, merchant FROM transactions WHERE rowid > ? ORDER BY rowid LIMIT 5000',
+            (last_rowid,)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for rowid, description, stored in rows:
+            merchant = canonical_merchant(description)
+            if merchant != stored:
+                updates.append((merchant, rowid))
+        conn.executemany('UPDATE transactions SET merchant = ? WHERE rowid = ?', updates)
+        changed += len(updates)
+        last_rowid = rows[-1][0]
+    if changed:
+        bump_data_version(conn)
+
+
+# Every column of transactions, in table order
+TRANSACTION_COLUMNS = ('id', 'date', 'description', 'amount', 'category', 'custom_category', 'currency', 'account',
+                       'memo', 'fingerprint', 'rule_id', 'merchant', 'amount_cents')
+
+
+def _add_integer_key(conn):
+    """
+    Rebuild transactions with seq INTEGER PRIMARY KEY, an explicit alias of
+    the rowid. VACUUM may renumber an implicit rowid, which would point the
+    search index (keyed on rowid) at the wrong rows; an alias keeps its values.
+    Rows keep their rowid, so the search index stays valid as it is.
+    """
+    columns = [column[1] for column in conn.execute('PRAGMA table_info(transactions)')]
+    if 'seq' in columns:
+        return
+    indexes = [sql for (sql,) in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'transactions' AND sql IS NOT NULL"
+    )]
+    conn.execute('''
+    CREATE TABLE transactions_new (
+        id TEXT UNIQUE,
+        date TEXT,
+        description TEXT,
+        amount REAL,
+        category TEXT,
+        custom_category TEXT,
+        currency TEXT DEFAULT 'USD',
+        account TEXT,
+        memo TEXT,
+        fingerprint TEXT,
+        rule_id INTEGER,
+        merchant TEXT,
+        amount_cents INTEGER,
+        seq INTEGER PRIMARY KEY
+    )
+    ''')
+    column_list = ', '.join(TRANSACTION_COLUMNS)
+    conn.execute(
+        f'INSERT INTO transactions_new ({column_list}, seq) SELECT {column_list}, rowid FROM transactions'
+    )
+    conn.execute('DROP TABLE transactions')
+    conn.execute('ALTER TABLE transactions_new RENAME TO transactions')
+    for sql in indexes:
+        conn.execute(sql)
+
+
+# Ordered schema history. Append new steps at the end; never edit or
+# renumber a step that may already have been applied somewhere.
+MIGRATIONS = [
+    (1, 'Create transactions table', _create_transactions_table),
+    (2, 'Add currency, account and memo columns', _add_currency_account_memo),
+    (3, 'Index the sort keys used by keyset pagination', _create_sort_indexes),
+    (4, 'Add (date, id), (account, date), (category, date) and (currency, date) indexes', _create_filter_indexes),
+    (5, 'Add indexed content fingerprint for deduplicating imports', _add_fingerprints),
+    (6, 'Add covering index for the summary API', _create_summary_index),
+    (7, 'Add monthly rollups table', _create_monthly_rollups),
+    (8, 'Add full-text search index over description and memo', _create_search_index),
+    (9, 'Add categorization rules', _create_categorization_rules),
+    (10, 'Add indexed canonical merchant column', _add_merchants),
+    (11, 'Store ISO dates and integer-cent amounts', _add_typed_dates_and_cents),
+    (12, 'Add data version counter', _create_data_version),
+    (13, 'Drop filter indexes no query uses', _drop_unused_filter_indexes),
+    (14, 'Recompute canonical merchants', _recompute_merchants),
+    (15, 'Key transactions on an explicit integer primary key', _add_integer_key),
+    (16, 'Recompute canonical merchants without authorization dates', _recompute_merchants),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TEXT,
+        duration_ms REAL
+    )
+    ''')
+    conn.commit()
+
+
+def current_version(conn):
+    """Highest migration version applied to the database, 0 for a fresh one"""
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def applied_migrations(conn):
+    """The schema_version history as a list of dicts"""
+    _ensure_version_table(conn)
+    cursor = conn.execute('SELECT version, description, applied_at, duration_ms FROM schema_version ORDER BY version')
+    return [
+        {'version': version, 'description': description, 'applied_at': applied_at, 'duration_ms': duration_ms}
+        for version, description, applied_at, duration_ms in cursor
+    ]
+
+
+def apply_migrations(conn):
+    """
+    Apply every pending migration in order, each in its own short write
+    transaction so readers keep working while it runs. Safe to call from
+    several processes at once: the version is re-checked under the write lock.
+    Returns the (version, description, duration_ms) of the steps applied.
+    """
+    applied = []
+
+    conn.execute(f'PRAGMA busy_timeout = {MIGRATION_BUSY_TIMEOUT_MS}')
+    try:
+        _ensure_version_table(conn)
+        for version, description, step in MIGRATIONS:
+            if version <= current_version(conn):
+                continue
+
+            start = time.perf_counter()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Another worker may have applied it while we waited for the lock
+                if version <= current_version(conn):
+                    conn.rollback()
+                    continue
+
+                step(conn)
+                duration_ms = (time.perf_counter() - start) * 1000
+                conn.execute(
+                    'INSERT INTO schema_version (version, description, applied_at, duration_ms) VALUES (?, ?, ?, ?)',
+                    (version, description, datetime.datetime.now().isoformat(timespec='seconds'), round(duration_ms, 3))
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            logger.info("Applied migration %d: %s", version, description, extra={'ms': round(duration_ms, 1)})
+            applied.append((version, description, duration_ms))
+    finally:
+        conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+
+    return applied
+
+
+def ensure_schema():
+    """
+    apply_migrations() once per process. Threads that call it while the
+    migrations run wait for them; every later call returns without touching
+    the database.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        conn = get_db()
+        try:
+            apply_migrations(conn)
+        finally:
+            conn.close()
+        _schema_ready = True
+
+
+if __name__ == '__main__':
+    from logging_config import configure_logging
+
+    configure_logging()
+    conn = get_db()
+    try:
+        applied = apply_migrations(conn)
+        if not applied:
+            print(f"Schema is up to date at version {current_version(conn)}")
+        for migration in applied_migrations(conn):
+            print(f"{migration['version']:>4}  {migration['applied_at']}  "
+                  f"{migration['duration_ms']:>10.1f} ms  {migration['description']}")
+    finally:
+        conn.close()
@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Serialized response bodies (and their compressed forms) kept per worker process
+RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES', str(64 * 1024 * 1024)))
+
+# Bodies smaller than this are sent as they are; compressing them saves next to nothing
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def choose_encoding(accept_encoding):
+    """'br', 'gzip' or None for an Accept-Encoding header, preferring brotli when it is installed"""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q=') and quality[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def entity_tags(key, version):
+    """
+    Strong ETag of each encoding of the response for key at a data version.
+    A strong ETag names exact bytes, so every encoding gets its own.
+    """
+    base = f"{version}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+    return {None: base, 'gzip': f'{base}-gzip', 'br': f'{base}-br'}
+
+
+class CachedBody:
+    """One serialized response body, compressed on demand"""
+
+    __slots__ = ('key', 'version', 'tags', 'body', '_encoded', 'size')
+
+    def __init__(self, key, version, body):
+        self.key = key
+        self.version = version
+        self.tags = entity_tags(key, version)
+        self.body = body
+        self._encoded = {}
+        self.size = len(body)
+
+    def encoded(self, encoding):
+        """The body in encoding ('gzip', 'br' or None) and the encoding actually used"""
+        if encoding is None or len(self.body) < MIN_COMPRESS_BYTES:
+            return self.body, None
+        data = self._encoded.get(encoding)
+        if data is None:
+            if encoding == 'br':
+                data = brotli.compress(self.body, quality=BROTLI_QUALITY)
+            else:
+                data = gzip.compress(self.body, compresslevel=GZIP_LEVEL)
+            self._encoded[encoding] = data
+            self.size += len(data)
+        return data, encoding
+
+
+class ResponseCache:
+    """
+    Least recently used response bodies by request key. An entry is only
+    valid for the data version it was built at, so any write to the
+    transactions table retires every entry at once without touching them.
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, version, body):
+        """
+        Remember body for key at version and return its entry. Bodies bigger
+        than half the cache are returned without being kept, so one huge
+        response cannot push out everything else.
+        """
+        entry = CachedBody(key, version, body)
+        if len(body) > self.max_bytes // 2:
+            return entry
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+        return entry
+
+    def encoded(self, entry, encoding):
+        """entry.encoded(encoding), keeping the cache's size accounting right"""
+        size = entry.size
+        data, used = entry.encoded(encoding)
+        if entry.size != size:
+            with self._lock:
+                if self._entries.get(entry.key) is entry:
+                    self._bytes += entry.size - size
+                    self._evict()
+        return data, used
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'brotli': brotli is not None,
+            }
+
+
+response_cache = ResponseCache()
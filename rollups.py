@@ -0,0 +1,129 @@
+import sys
+from database import get_db
+
+# Category shown for a transaction: the user's override, else the imported one
+EFFECTIVE_CATEGORY_SQL = "COALESCE(NULLIF(custom_category, ''), NULLIF(category, ''), '')"
+
+# Calendar month (YYYY-MM) of a transaction. Imports store ISO dates; text
+# that is not a valid date is kept as written, so MM/DD/YYYY is still read
+# (e.g. 02/30/2025) and anything else falls in the '' month.
+MONTH_SQL = ("CASE WHEN date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' THEN substr(date, 1, 7) "
+             "WHEN date GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*' "
+             "THEN substr(date, 7, 4) || '-' || substr(date, 1, 2) "
+             "ELSE '' END")
+
+# Key of the monthly_rollups table, mapped to the transactions expression
+# each column is computed from
+ROLLUP_DIMENSIONS = {
+    'month': MONTH_SQL,
+    'category': EFFECTIVE_CATEGORY_SQL,
+    'account': "IFNULL(account, '')",
+    'currency': "IFNULL(currency, '')",
+}
+
+# Totals are kept in whole cents so adding and subtracting rows never drifts
+CENTS_SQL = 'amount_cents'
+
+ROLLUP_COLUMNS = ('month', 'category', 'account', 'currency',
+                  'count', 'total_cents', 'income_cents', 'expense_cents')
+
+
+def _aggregate_sql(where, sign=''):
+    """Rollup rows for the transactions matching where, negated when sign is '-'"""
+    keys = ', '.join(ROLLUP_DIMENSIONS.values())
+    return (
+        f'SELECT {keys}, {sign}COUNT(*), {sign}IFNULL(SUM({CENTS_SQL}), 0), '
+        f'{sign}IFNULL(SUM(CASE WHEN amount > 0 THEN {CENTS_SQL} END), 0), '
+        f'{sign}IFNULL(SUM(CASE WHEN amount < 0 THEN {CENTS_SQL} END), 0) '
+        f"FROM transactions {f'WHERE {where} ' if where else ''}GROUP BY {keys}"
+    )
+
+
+def _apply(conn, where, params, sign):
+    conn.execute(
+        f"INSERT INTO monthly_rollups ({', '.join(ROLLUP_COLUMNS)}) {_aggregate_sql(where, sign)} "
+        'ON CONFLICT (month, category, account, currency) DO UPDATE SET '
+        'count = count + excluded.count, '
+        'total_cents = total_cents + excluded.total_cents, '
+        'income_cents = income_cents + excluded.income_cents, '
+        'expense_cents = expense_cents + excluded.expense_cents',
+        params
+    )
+
+
+def add_to_rollups(conn, where=None, params=()):
+    """
+    Count the transactions matching where (e.g. 'id = ?') in the rollups.
+    Call it in the same write transaction that stored or changed them.
+    """
+    _apply(conn, where, params, '')
+
+
+def remove_from_rollups(conn, where=None, params=()):
+    """
+    Take the transactions matching where out of the rollups. Call it before
+    changing or deleting them, in the same write transaction.
+    """
+    _apply(conn, where, params, '-')
+    conn.execute('DELETE FROM monthly_rollups WHERE count = 0')
+
+
+def clear_rollups(conn):
+    conn.execute('DELETE FROM monthly_rollups')
+
+
+def rollup_differences(conn):
+    """Groups where monthly_rollups disagrees with a fresh aggregate of the transactions table"""
+    actual = {row[:4]: row[4:] for row in conn.execute(_aggregate_sql(None))}
+    stored = {row[:4]: row[4:] for row in conn.execute(f"SELECT {', '.join(ROLLUP_COLUMNS)} FROM monthly_rollups")}
+
+    differences = []
+    for key in sorted(set(actual) | set(stored)):
+        if actual.get(key) != stored.get(key):
+            differences.append({
+                'group': dict(zip(ROLLUP_COLUMNS, key)),
+                'stored': dict(zip(ROLLUP_COLUMNS[4:], stored.get(key, (0, 0, 0, 0)))),
+                'actual': dict(zip(ROLLUP_COLUMNS[4:], actual.get(key, (0, 0, 0, 0)))),
+            })
+    return differences
+
+
+def rebuild_rollups(conn):
+    """
+    Recompute monthly_rollups from the transactions table under the write
+    lock. Returns the differences found before rebuilding.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        differences = rollup_differences(conn)
+        clear_rollups(conn)
+        add_to_rollups(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return differences
+
+
+if __name__ == '__main__':
+    # python rollups.py           verify and rebuild the rollups
+    # python rollups.py --check   only verify; exits 1 when they are out of date
+    from migrations import apply_migrations
+
+    check_only = '--check' in sys.argv[1:]
+    conn = get_db()
+    try:
+        apply_migrations(conn)
+        differences = rollup_differences(conn) if check_only else rebuild_rollups(conn)
+    finally:
+        conn.close()
+
+    for difference in differences:
+        print(f"{difference['group']}: stored {difference['stored']}, actual {difference['actual']}")
+    if not differences:
+        print("Rollups match the transactions table")
+    elif check_only:
+        print(f"{len(differences)} rollup groups are out of date; run python rollups.py to rebuild them")
+        sys.exit(1)
+    else:
+        print(f"Rebuilt rollups, fixing {len(differences)} groups")
@@ -0,0 +1,269 @@
+import logging
+import re
+import time
+from functools import lru_cache
+from database import bump_data_version
+from rollups import add_to_rollups, remove_from_rollups
+
+logger = logging.getLogger(__name__)
+
+RULE_MATCH_TYPES = ('contains', 'regex')
+
+RULE_COLUMNS = ('id', 'name', 'match_type', 'pattern', 'min_amount', 'max_amount',
+                'category', 'priority', 'enabled', 'created_at')
+
+# Distinct descriptions whose rule scan is remembered by one matcher
+MATCH_CACHE_SIZE = 65536
+
+# Rows read per step when re-running the rules over the table
+APPLY_BATCH_SIZE = 5000
+
+NUMBERED_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?\(\d')
+
+
+class Rule:
+    """
+    One categorization rule: the description contains a substring or matches
+    a regex (case-insensitively), and/or the amount is within
+    [min_amount, max_amount]. Either bound may be None.
+    """
+
+    __slots__ = ('id', 'name', 'match_type', 'pattern', 'min_amount', 'max_amount',
+                 'category', 'priority', 'regex')
+
+    def __init__(self, id, name, match_type, pattern, min_amount, max_amount, category, priority):
+        self.id = id
+        self.name = name
+        self.match_type = match_type
+        self.pattern = pattern or None
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+        self.category = category
+        self.priority = priority
+        self.regex = None
+        if self.pattern:
+            source = self.pattern if match_type == 'regex' else re.escape(self.pattern)
+            self.regex = re.compile(source, re.IGNORECASE)
+
+    def accepts_amount(self, amount):
+        if self.min_amount is None and self.max_amount is None:
+            return True
+        if amount is None or amount != amount:
+            return False
+        if self.min_amount is not None and amount < self.min_amount:
+            return False
+        if self.max_amount is not None and amount > self.max_amount:
+            return False
+        return True
+
+
+def validate_rule(data):
+    """
+    Check a rule posted to the API and return its column values, or raise
+    ValueError saying what is wrong with it
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+
+    category = data.get('category')
+    if not isinstance(category, str) or not category.strip():
+        raise ValueError('category is required')
+
+    match_type = data.get('match_type', 'contains')
+    if match_type not in RULE_MATCH_TYPES:
+        raise ValueError(f"match_type must be one of: {', '.join(RULE_MATCH_TYPES)}")
+
+    pattern = data.get('pattern') or ''
+    if not isinstance(pattern, str):
+        raise ValueError('pattern must be a string')
+    if match_type == 'regex' and pattern:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f'Invalid regex: {str(e)}')
+
+    bounds = {}
+    for field in ('min_amount', 'max_amount'):
+        value = data.get(field)
+        if value in (None, ''):
+            bounds[field] = None
+            continue
+        try:
+            bounds[field] = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{field} must be a number')
+    if not pattern and bounds['min_amount'] is None and bounds['max_amount'] is None:
+        raise ValueError('A rule needs a pattern, an amount range or both')
+    if (bounds['min_amount'] is not None and bounds['max_amount'] is not None
+            and bounds['min_amount'] > bounds['max_amount']):
+        raise ValueError('min_amount is greater than max_amount')
+
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        raise ValueError('priority must be an integer')
+
+    return {
+        'name': str(data.get('name') or pattern or category),
+        'match_type': match_type,
+        'pattern': pattern,
+        'min_amount': bounds['min_amount'],
+        'max_amount': bounds['max_amount'],
+        'category': category.strip(),
+        'priority': priority,
+        'enabled': 1 if data.get('enabled', True) else 0,
+    }
+
+
+class RuleMatcher:
+    """
+    The enabled rules compiled for matching many rows. Higher priority wins,
+    then the older rule.
+
+    Every pattern is folded into one regex of zero-width alternatives, so one
+    scan of a description finds, at each position, the best rule whose
+    pattern starts there. The scan is cached per distinct description, since
+    the same merchants repeat throughout an export.
+    """
+
+    def __init__(self, rules):
+        self.rules = sorted(rules, key=lambda rule: (-rule.priority, rule.id))
+        self.has_rules = bool(self.rules)
+        self._amount_only = [index for index, rule in enumerate(self.rules) if rule.regex is None]
+        # Numbered backreferences would point at the wrong group once the
+        # patterns share one regex, so those rules are searched on their own
+        combined = [index for index, rule in enumerate(self.rules)
+                    if rule.regex is not None and not NUMBERED_BACKREFERENCE.search(rule.regex.pattern)]
+        self._separate = [index for index, rule in enumerate(self.rules)
+                          if rule.regex is not None and index not in combined]
+        self._combined = None
+        if combined:
+            alternatives = '|'.join(f'(?P<r{index}>{self.rules[index].regex.pattern})' for index in combined)
+            try:
+                self._combined = re.compile(f'(?=(?:{alternatives}))', re.IGNORECASE)
+            except re.error:
+                # e.g. inline flags in the middle of a pattern or a group name clash
+                self._separate = [index for index, rule in enumerate(self.rules) if rule.regex is not None]
+        self._scan = lru_cache(maxsize=MATCH_CACHE_SIZE)(self._scan_description)
+
+    def _scan_description(self, description):
+        """Indexes of the rules whose pattern was found in description, best first"""
+        found = set()
+        if self._combined is not None:
+            found.update(int(match.lastgroup[1:]) for match in self._combined.finditer(description))
+        found.update(index for index in self._separate if self.rules[index].regex.search(description))
+        return tuple(sorted(found))
+
+    def match(self, description, amount):
+        """The rule that categorizes a transaction, or None"""
+        if not self.has_rules:
+            return None
+        description = description or ''
+        found = self._scan(description)
+        candidates = sorted(found + tuple(self._amount_only)) if self._amount_only else found
+        for index in candidates:
+            if self.rules[index].accepts_amount(amount):
+                return self.rules[index]
+
+        # A pattern rule that starts at the same position as a better one is
+        # hidden by the combined scan. That only matters when an amount range
+        # turned the better one down, so check every rule the slow way then.
+        if found:
+            for rule in self.rules:
+                if rule.regex is not None and rule.accepts_amount(amount) and rule.regex.search(description):
+                    return rule
+        return None
+
+    def categorize_rows(self, rows, category_index=3):
+        """
+        Fill in the category of uncategorized (date, description, amount,
+        category, ...) tuples. Returns the rows with the matching rule's id
+        appended (None where no rule applied) and the number categorized.
+        """
+        categorized = []
+        matched = 0
+        for row in rows:
+            rule = None
+            if not row[category_index]:
+                rule = self.match(row[1], row[2])
+            if rule is None:
+                categorized.append(row + (None,))
+            else:
+                matched += 1
+                categorized.append(row[:category_index] + (rule.category,) + row[category_index + 1:] + (rule.id,))
+        return categorized, matched
+
+
+def load_rules(conn):
+    cursor = conn.execute(
+        'SELECT id, name, match_type, pattern, min_amount, max_amount, category, priority '
+        'FROM categorization_rules WHERE enabled = 1'
+    )
+    return [Rule(*row) for row in cursor]
+
+
+def load_matcher(conn):
+    return RuleMatcher(load_rules(conn))
+
+
+def apply_rules(conn, batch_size=APPLY_BATCH_SIZE):
+    """
+    Re-run the enabled rules over every transaction that has no imported
+    category: rows categorized by a rule earlier are re-evaluated, so edited
+    or deleted rules take effect. Custom categories set by the user are left
+    alone, and the summary rollups follow the changes. Commits per batch.
+    Returns the number of rows scanned, matched and changed, with the throughput.
+    """
+    matcher = load_matcher(conn)
+    start = time.perf_counter()
+    scanned = matched = changed = 0
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            'SELECT rowid, description, amount, category, rule_id FROM transactions '
+            "WHERE rowid > ? AND (IFNULL(category, '') = '' OR rule_id IS NOT NULL) "
+            'ORDER BY rowid LIMIT ?',
+            (last_rowid, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        scanned += len(rows)
+
+        updates = []
+        for rowid, description, amount, category, rule_id in rows:
+            rule = matcher.match(description, amount)
+            if rule is not None:
+                matched += 1
+            new_category, new_rule_id = (rule.category, rule.id) if rule is not None else ('', None)
+            if (category or '') != new_category or rule_id != new_rule_id:
+                updates.append((new_category, new_rule_id, rowid))
+        if not updates:
+            continue
+
+        rowids = [rowid for category, rule_id, rowid in updates]
+        where = f"rowid IN ({', '.join('?' * len(rowids))})"
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            remove_from_rollups(conn, where, rowids)
+            conn.executemany('UPDATE transactions SET category = ?, rule_id = ? WHERE rowid = ?', updates)
+            add_to_rollups(conn, where, rowids)
+            bump_data_version(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        changed += len(updates)
+
+    elapsed = time.perf_counter() - start
+    rate = scanned / elapsed if elapsed > 0 else 0.0
+    logger.info("Applied %d rules over %d rows: %d matched, %d changed", len(matcher.rules), scanned, matched,
+                changed, extra={'seconds': round(elapsed, 3), 'rows_per_second': round(rate)})
+    return {
+        'rules': len(matcher.rules),
+        'rows': scanned,
+        'matched': matched,
+        'changed': changed,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rate, 1),
+    }
@@ -0,0 +1,111 @@
+import os
+import re
+from database import TRANSACTION_FIELDS, get_db
+
+# Broad queries (a common word, a two-letter prefix) can match most of the
+# table; ranking is limited to this many of the most recent matches so a
+# typeahead request costs the same however many rows are stored
+SEARCH_CANDIDATES = int(os.environ.get('SEARCH_CANDIDATES', '1000'))
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def index_transactions(conn, where=None, params=()):
+    """
+    Add the transactions matching where (e.g. 'rowid > ?') to the search
+    index. Call it in the write transaction that stored or changed them.
+    """
+    conn.execute(
+        'INSERT INTO transactions_fts (rowid, description, memo) '
+        f"SELECT rowid, description, memo FROM transactions{f' WHERE {where}' if where else ''}",
+        params
+    )
+
+
+def unindex_transactions(conn, where, params=()):
+    """
+    Take the transactions matching where out of the search index. The index
+    only stores tokens, so this must run before their description or memo
+    is changed or the row is deleted.
+    """
+    conn.execute(
+        "INSERT INTO transactions_fts (transactions_fts, rowid, description, memo) "
+        f"SELECT 'delete', rowid, description, memo FROM transactions WHERE {where}",
+        params
+    )
+
+
+def clear_search_index(conn):
+    conn.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('delete-all')")
+
+
+def rebuild_search_index(conn):
+    """Re-tokenize every transaction, e.g. if the index was left out of sync by a manual edit"""
+    conn.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+
+
+def match_query(text):
+    """
+    FTS5 query for what the user typed: every word must appear, and the last
+    one may be incomplete ('star buc' finds 'Starbucks Coffee' rows). Returns
+    None when the text has no searchable characters.
+    """
+    tokens = TOKEN_PATTERN.findall(text)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    if not text[-1].isspace():
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_transactions(conn, text, limit, after=None):
+    """
+    Transactions whose description or memo match text, best bm25 match first
+    (ties newest first). Only the SEARCH_CANDIDATES most recent matches are
+    ranked, so an older row that matches better is not returned when a
+    query matches more rows than that. after is the (score, rowid) of the
+    previous page's last row. Returns (rows, has_more); each row is a dict with its _score
+    and _rowid for building the next cursor.
+    """
+    query = match_query(text)
+    if query is None:
+        return [], False
+
+    clauses = []
+    params = [query, SEARCH_CANDIDATES]
+    if after is not None:
+        score, rowid = after
+        clauses.append('(m.score > ? OR (m.score = ? AND m.rowid < ?))')
+        params.extend([score, score, rowid])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+
+    # The inner query walks the index newest first and stops after
+    # SEARCH_CANDIDATES matches; only those are scored and sorted
+    cursor = conn.execute(
+        f'SELECT m.score AS _score, m.rowid AS _rowid, {TRANSACTION_FIELDS} FROM ('
+        'SELECT rowid, bm25(transactions_fts) AS score FROM transactions_fts '
+        'WHERE transactions_fts MATCH ? ORDER BY rowid DESC LIMIT ?'
+        f') AS m JOIN transactions AS t ON t.rowid = m.rowid {where} '
+        'ORDER BY m.score, m.rowid DESC LIMIT ?',
+        params + [limit + 1]
+    )
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor]
+    return rows[:limit], len(rows) > limit
+
+
+if __name__ == '__main__':
+    # python search.py   rebuild the full-text search index
+    from migrations import apply_migrations
+
+    conn = get_db()
+    try:
+        apply_migrations(conn)
+        conn.execute('BEGIN IMMEDIATE')
+        rebuild_search_index(conn)
+        conn.commit()
+        count = conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+    finally:
+        conn.close()
+    print(f"Rebuilt the search index over {count} transactions")
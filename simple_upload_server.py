@@ -2,31 +2,37 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
 import csv
-import sqlite3
-import uuid
+import logging
+from batch_writer import BatchedWriter
+from database import get_db
+from logging_config import configure_logging
+from migrations import ensure_schema
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
 @app.route('/api/upload_test', methods=['POST'])
 def upload_test():
-    print("Received test upload request")
+    logger.debug("Received test upload request")
     return jsonify({"status": "success"}), 200
 
 @app.route('/api/example', methods=['POST'])
 def use_example():
-    print("Received example file request")
+    logger.info("Received example file request")
     # Try to process the example file
     try:
-        rows = process_csv('accountactivity.csv')
-        return jsonify({"status": "success", "rows": rows}), 200
+        result = process_csv('accountactivity.csv')
+        return jsonify({"status": "success", **result}), 200
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception("Error processing CSV")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    print("Received file upload request")
+    logger.info("Received file upload request")
     if 'file' not in request.files:
         return jsonify({"status": "error", "message": "No file part"}), 400
     
@@ -40,38 +46,37 @@ def upload_file():
         file.save(temp_path)
         
         # Process the file
-        rows = process_csv(temp_path)
+        result = process_csv(temp_path)
         
         # Clean up
         if os.path.exists(temp_path):
             os.remove(temp_path)
         
-        return jsonify({"status": "success", "rows": rows}), 200
+        return jsonify({"status": "success", **result}), 200
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception("Error processing CSV")
         # Clean up
         if os.path.exists('temp_upload.csv'):
             os.remove('temp_upload.csv')
         return jsonify({"status": "error", "message": str(e)}), 500
 
 def process_csv(file_path):
-    """Process a CSV file and return the number of rows processed"""
-    # Connect to database
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
-    processed_rows = 0
+    """
+    Process a CSV file. Returns the rows written and the duplicates skipped
+    because an earlier import already stored them.
+    """
+    # The schema is created or upgraded by the first import in this process
+    ensure_schema()
+    conn = get_db()
     
     try:
         # Read the CSV file
-        with open(file_path, 'r', newline='') as f:
+        with open(file_path, 'r', newline='') as f, BatchedWriter(conn, label='upload') as writer:
             reader = csv.reader(f, quoting=csv.QUOTE_ALL)
             for row in reader:
                 if len(row) < 3:
                     continue
                 
-                # Create a transaction ID
-                transaction_id = str(uuid.uuid4())
-                
                 # Get date and description
                 date = row[0].strip()
                 description = row[1].strip()
@@ -96,21 +101,13 @@ def process_csv(file_path):
                 if amount is None:
                     continue
                 
-                # Insert into database
-                cursor.execute(
-                    'INSERT INTO transactions (id, date, description, amount, category) VALUES (?, ?, ?, ?, ?)',
-                    (transaction_id, date, description, amount, '')
-                )
-                processed_rows += 1
-        
-        # Commit the changes
-        conn.commit()
-    except Exception as e:
+                # Queue for the batched insert
+                writer.add(date, description, amount, '', 'USD', None, None)
+    finally:
         conn.close()
-        raise e
     
-    conn.close()
-    return processed_rows
+    # Counted once the writer has flushed its last chunk
+    return {'rows': writer.rows_written, 'duplicates': writer.rows_skipped}
 
 if __name__ == '__main__':
     app.run(port=5001, debug=True)
@@ -0,0 +1,108 @@
+import pytest
+
+from batch_writer import normalize_date
+from csv_formats import import_transactions, parse_file
+
+# Each export with the (date, description, amount, category, currency,
+# account, memo) rows the processors in the original app.py stored for it
+CASES = {
+    'quoted_thousands': (
+        'account_activity',
+        '04/01/2025,"PAYROLL DEPOSIT, ACME",,"1,234.56"\n'
+        '04/02/2025,"RENT PAYMENT","1,500.00",\n'
+        '04/03/2025,COFFEE,4.50,\n',
+        [('04/01/2025', 'PAYROLL DEPOSIT, ACME', 1234.56, '', 'USD', '', ''),
+         ('04/02/2025', 'RENT PAYMENT', -1500.0, '', 'USD', '', ''),
+         ('04/03/2025', 'COFFEE', -4.5, '', 'USD', '', '')],
+    ),
+    # A debit that is not a number falls back to the credit; a row with neither is skipped
+    'invalid_debit': (
+        'account_activity',
+        '04/01/2025,REFUND,PENDING,25.00\n'
+        '04/02/2025,GROCER,12.00,\n'
+        '04/03/2025,NO AMOUNT,PENDING,\n',
+        [('04/01/2025', 'REFUND', 25.0, '', 'USD', '', ''),
+         ('04/02/2025', 'GROCER', -12.0, '', 'USD', '', '')],
+    ),
+    # Outflow minus inflow, written with $ and thousands separators; an empty cell is zero
+    'budget_dollars': (
+        'budget',
+        'Account,Flag,Date,Payee,Category,Memo,Outflow,Inflow\n'
+        'Checking,,04/01/2025,Landlord,Rent,April,"$1,500.00",$0.00\n'
+        'Checking,,04/02/2025,Employer,Income,,$0.00,"$2,345.67"\n'
+        'Card,,04/03/2025,Cafe,Food,,$4.50,\n',
+        [('04/01/2025', 'Landlord', 1500.0, 'Rent', 'USD', 'Checking', 'April'),
+         ('04/02/2025', 'Employer', -2345.67, 'Income', 'USD', 'Checking', ''),
+         ('04/03/2025', 'Cafe', 4.5, 'Food', 'USD', 'Card', '')],
+    ),
+    # Rows narrower than the first, including one too short to have an amount
+    'ragged_rows': (
+        'account_activity',
+        '04/01/2025,COFFEE,4.50,,995.50\n'
+        '04/02/2025,PAYROLL,,"2,000.00"\n'
+        '04/03/2025,SHORT\n'
+        '04/04/2025,GROCER,30.25\n',
+        [('04/01/2025', 'COFFEE', -4.5, '', 'USD', '', ''),
+         ('04/02/2025', 'PAYROLL', 2000.0, '', 'USD', '', ''),
+         ('04/04/2025', 'GROCER', -30.25, '', 'USD', '', '')],
+    ),
+    # Rows wider than the first, which pandas' C parser rejects
+    'ragged_wider_rows': (
+        'account_activity',
+        '04/01/2025,COFFEE,4.50\n'
+        '04/02/2025,PAYROLL,,"2,000.00",2995.50\n'
+        '04/04/2025,GROCER,30.25,,2965.25\n',
+        [('04/01/2025', 'COFFEE', -4.5, '', 'USD', '', ''),
+         ('04/02/2025', 'PAYROLL', 2000.0, '', 'USD', '', ''),
+         ('04/04/2025', 'GROCER', -30.25, '', 'USD', '', '')],
+    ),
+    # A header no other format knows is read by the fallback, skipping that row
+    'account_activity_fallback': (
+        'account_activity',
+        'Posted Date,Details,Withdrawals,Deposits,Balance\n'
+        '2025-04-01,TRANSFER IN,,500.00,1500.00\n'
+        '2025-04-02,ATM WITHDRAWAL,60.00,,1440.00\n',
+        [('2025-04-01', 'TRANSFER IN', 500.0, '', 'USD', '', ''),
+         ('2025-04-02', 'ATM WITHDRAWAL', -60.0, '', 'USD', '', '')],
+    ),
+}
+
+
+def _late_wide_row():
+    """Past the matcher's sample, a row wider than all before it, so the file is read a second time"""
+    lines = [f'04/{day % 28 + 1:02d}/2025,SHOP {day},{day}.25' for day in range(60)]
+    lines.append('04/30/2025,PAYROLL,,"2,000.00",2995.50')
+    rows = [(f'04/{day % 28 + 1:02d}/2025', f'SHOP {day}', -(day + 0.25), '', 'USD', '', '') for day in range(60)]
+    rows.append(('04/30/2025', 'PAYROLL', 2000.0, '', 'USD', '', ''))
+    return 'account_activity', '\n'.join(lines) + '\n', rows
+
+
+CASES['late_wide_row'] = _late_wide_row()
+
+
+@pytest.fixture(params=sorted(CASES))
+def export(request, tmp_path):
+    processor, text, rows = CASES[request.param]
+    path = tmp_path / f'{request.param}.csv'
+    path.write_text(text, encoding='utf-8')
+    return path, processor, rows
+
+
+def test_parse_file_matches_original_parsers(export):
+    path, processor, rows = export
+    parsed = parse_file(str(path))
+
+    assert parsed['processor'] == processor
+    assert parsed['errors'] == []
+    assert parsed['rows'] == rows
+
+
+def test_import_stores_original_rows_with_iso_dates(conn, export):
+    path, processor, rows = export
+    result = import_transactions(conn, str(path))
+
+    assert result['format'] == processor
+    assert result['rows'] == len(rows)
+    stored = conn.execute('SELECT date, description, amount, category, currency, account, memo '
+                          'FROM transactions ORDER BY seq').fetchall()
+    assert stored == [(normalize_date(row[0]),) + row[1:] for row in rows]
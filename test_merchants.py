@@ -0,0 +1,34 @@
+import pytest
+
+from merchants import canonical_merchant
+
+
+@pytest.mark.parametrize('description, merchant', [
+    ('POS PURCHASE 1234 STARBUCKS #552 SEATTLE WA', 'STARBUCKS'),
+    ('CHECKCARD 0412 SHELL OIL 5739', 'SHELL OIL'),
+    ('PURCHASE 04/12 TARGET', 'TARGET'),
+    ('VISA XXXX1234 NETFLIX.COM', 'NETFLIX.COM'),
+    ('DEBIT CARD PURCHASE WHOLE FOODS', 'WHOLE FOODS'),
+    ('SQ *BLUE BOTTLE COFFEE', 'BLUE BOTTLE COFFEE'),
+    ('TST* JOES PIZZA', 'JOES PIZZA'),
+    ('AMAZON.COM*MK1234', 'AMAZON.COM'),
+    # A '*' after the name ends it
+    ('UBER *TRIP', 'UBER'),
+    # A processor code in front of a name that a '*' ends is dropped too
+    ('DD DOORDASH*CHIPOTLE', 'DOORDASH'),
+    # The date of a card authorization is not part of the name
+    ('PURCHASE AUTHORIZED ON 04/12 SHELL OIL 123', 'SHELL OIL'),
+    ('PREAUTHORIZED ON 03/02 COMCAST CABLE', 'COMCAST CABLE'),
+    # Prefix words and short numbers that are part of the name stay
+    ('MC DONALDS 123', 'MC DONALDS'),
+    ('CARD FACTORY', 'CARD FACTORY'),
+    ('ONLINE SHOPPING', 'ONLINE SHOPPING'),
+    # Nor are prefix words dropped when only another prefix word would be left
+    ('CREDIT CARD PAYMENT', 'CREDIT CARD PAYMENT'),
+    ('7 ELEVEN', '7 ELEVEN'),
+    ('12345678', '12345678'),
+    ('', ''),
+    (None, ''),
+])
+def test_canonical_merchant(description, merchant):
+    assert canonical_merchant(description) == merchant
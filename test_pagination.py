@@ -0,0 +1,69 @@
+import pytest
+
+from batch_writer import BatchedWriter
+
+SORTS = ('date', 'amount', 'description', 'category')
+
+CATEGORIES = ('Food', 'Travel', '', 'Bills')
+
+
+@pytest.fixture
+def seeded(conn):
+    """
+    73 transactions with many ties on every sort key, plus missing dates,
+    amounts and categories, so pages often end in the middle of a tie
+    """
+    with BatchedWriter(conn, batch_size=20, dedupe=False) as writer:
+        for number in range(73):
+            date = None if number % 11 == 0 else f'2025-0{number % 3 + 1}-{number % 5 + 1:02d}'
+            amount = None if number % 13 == 0 else -float(number % 4 * 5)
+            writer.add(date, f'SHOP {number % 6}', amount, CATEGORIES[number % 4])
+    ids = [row[0] for row in conn.execute('SELECT id FROM transactions')]
+    # Custom categories take part in the category sort
+    conn.executemany('UPDATE transactions SET custom_category = ? WHERE id = ?',
+                     [('Gifts', transaction_id) for transaction_id in ids[::7]])
+    conn.commit()
+    return conn
+
+
+def _walk(client, query):
+    """Ids of every page of the paginated transactions API, in order"""
+    ids = []
+    cursor = None
+    while True:
+        url = f'/api/transactions?limit=7&{query}' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url)
+        assert response.status_code == 200, response.get_json()
+        page = response.get_json()
+        ids.extend(transaction['id'] for transaction in page['transactions'])
+        if not page['has_more']:
+            return ids
+        cursor = page['next_cursor']
+
+
+@pytest.mark.parametrize('direction', ('asc', 'desc'))
+@pytest.mark.parametrize('sort', SORTS)
+def test_pages_cover_every_row_once_in_order(client, seeded, sort, direction):
+    import app
+
+    sort_key = app.TRANSACTION_SORT_KEYS[sort]
+    expected = [row[0] for row in seeded.execute(
+        f'SELECT id FROM transactions ORDER BY {sort_key} {direction}, id {direction}')]
+
+    assert _walk(client, f'sort={sort}&direction={direction}') == expected
+
+
+@pytest.mark.parametrize('query, where, params', [
+    ('category=Food', "COALESCE(NULLIF(custom_category, ''), NULLIF(category, ''), '') = ?", ['Food']),
+    ('category=Uncategorized', "COALESCE(NULLIF(custom_category, ''), NULLIF(category, ''), '') = ?", ['']),
+    ('date_from=2025-02-01', 'date >= ?', ['2025-02-01']),
+    ('date_to=2025-02-03', "date <= ? AND date > ''", ['2025-02-03']),
+    ('date_from=2025-01-02&date_to=2025-02-04', 'date BETWEEN ? AND ?', ['2025-01-02', '2025-02-04']),
+])
+def test_filtered_pages_cover_every_match(client, seeded, query, where, params):
+    expected = {row[0] for row in seeded.execute(f'SELECT id FROM transactions WHERE {where}', params)}
+    assert expected
+
+    ids = _walk(client, f'sort=amount&{query}')
+    assert len(ids) == len(set(ids))
+    assert set(ids) == expected
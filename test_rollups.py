@@ -0,0 +1,78 @@
+import pytest
+
+from batch_writer import BatchedWriter
+from rollups import rollup_differences
+
+CSV = (
+    'date,description,amount,category,account\n'
+    '2025-01-03,STARBUCKS #552 SEATTLE WA,-4.50,Food,Checking\n'
+    '2025-01-03,PAYROLL DEPOSIT,2500.00,Income,Checking\n'
+    '2025-01-17,SHELL OIL 5739,-41.20,Travel,Card\n'
+    '2025-02-01,UBER *TRIP,-18.75,,Card\n'
+    '2025-02-14,AMAZON.COM*MK1234,-62.10,Shopping,Card\n'
+    '2025-03-02,CITY WATER UTIL,-55.00,Bills,Checking\n'
+)
+
+
+def _upload(client, body=CSV, filename='export.csv'):
+    response = client.post(f'/api/upload-csv?filename={filename}', data=body.encode('utf-8'),
+                           content_type='text/csv')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def _ids(conn):
+    return [row[0] for row in conn.execute('SELECT id FROM transactions ORDER BY date, description')]
+
+
+def test_import_matches_rollups(client, conn):
+    _upload(client)
+    assert conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0] == 6
+    assert rollup_differences(conn) == []
+
+    # Re-importing the same export only skips duplicates
+    _upload(client)
+    assert conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0] == 6
+    assert rollup_differences(conn) == []
+
+
+def test_edits_keep_rollups_in_sync(client, conn):
+    _upload(client)
+    first, second, third = _ids(conn)[:3]
+
+    assert client.put(f'/api/transactions/{first}/category', json={'custom_category': 'Coffee'}).status_code == 200
+    assert client.put(f'/api/transaction/{second}/account', json={'account': 'Savings'}).status_code == 200
+    assert client.put(f'/api/transaction/{third}/currency', json={'currency': 'EUR'}).status_code == 200
+    assert rollup_differences(conn) == []
+
+    response = client.patch('/api/transactions',
+                            json={'filter': {'account': 'Card'}, 'set': {'custom_category': 'Cards'}})
+    assert response.status_code == 200, response.get_json()
+    response = client.patch('/api/transactions', json={'changes': [{'id': first, 'account': 'Wallet'},
+                                                                   {'id': second, 'custom_category': ''}]})
+    assert response.status_code == 200, response.get_json()
+    assert rollup_differences(conn) == []
+
+    summary = client.get('/api/summary/category?category=Cards').get_json()
+    assert summary['totals']['count'] == 3
+
+
+def test_failed_atomic_import_takes_its_chunks_out_of_the_rollups(client, conn):
+    _upload(client)
+
+    with pytest.raises(RuntimeError):
+        with BatchedWriter(conn, batch_size=2, atomic=True) as writer:
+            for day in range(1, 8):
+                writer.add(f'2025-04-{day:02d}', f'GROCER {day}', -10.0 * day, 'Food')
+            assert writer.chunks_written == 3
+            raise RuntimeError('import failed part way')
+
+    assert conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0] == 6
+    assert rollup_differences(conn) == []
+
+
+def test_delete_all_clears_rollups(client, conn):
+    _upload(client)
+    assert client.delete('/api/transactions/delete-all').status_code == 200
+    assert conn.execute('SELECT COUNT(*) FROM monthly_rollups').fetchone()[0] == 0
+    assert rollup_differences(conn) == []
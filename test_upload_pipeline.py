@@ -0,0 +1,61 @@
+import io
+
+import pytest
+
+import batch_writer
+from batch_writer import BatchedWriter
+
+ROWS = 30000
+
+
+def _export(rows=ROWS):
+    lines = ['date,description,amount,category,account']
+    lines.extend(f'2025-{day % 12 + 1:02d}-{day % 28 + 1:02d},GROCER {day},-{day % 500 + 1}.25,Food,Checking'
+                 for day in range(rows))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _count(conn):
+    return conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+
+
+def test_large_raw_upload_imports_every_row(client, conn, monkeypatch):
+    import app
+
+    # Many insert chunks, all from the one streamed request
+    monkeypatch.setattr(batch_writer, 'INSERT_BATCH_SIZE', 1000)
+    body = _export()
+    # Large enough that the spooled copy of the request body moves to disk
+    assert len(body) > app.UPLOAD_SPOOL_BYTES
+
+    response = client.post('/api/upload-csv?filename=export.csv', data=body, content_type='text/csv')
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['message'] == f'Successfully processed {ROWS} rows'
+    assert _count(conn) == ROWS
+
+
+def test_multipart_upload_skips_rows_already_imported(client, conn):
+    body = _export(500)
+    assert client.post('/api/upload-csv?filename=export.csv', data=body, content_type='text/csv').status_code == 200
+
+    response = client.post('/api/upload-csv', data={'file': (io.BytesIO(body), 'export.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['duplicates'] == 500
+    assert _count(conn) == 500
+
+
+def test_failed_atomic_import_leaves_nothing_behind(client, conn):
+    client.post('/api/upload-csv?filename=export.csv', data=_export(10), content_type='text/csv')
+    before = _count(conn)
+
+    with pytest.raises(RuntimeError):
+        with BatchedWriter(conn, batch_size=2, atomic=True) as writer:
+            for day in range(1, 8):
+                writer.add(f'2025-04-{day:02d}', f'BAKERY {day}', -10.0 * day, 'Food')
+            assert writer.chunks_written == 3
+            raise RuntimeError('import failed part way')
+
+    assert _count(conn) == before
+    assert conn.execute("SELECT COUNT(*) FROM transactions_fts WHERE transactions_fts MATCH 'bakery'").fetchone()[0] == 0
+    conn.execute("INSERT INTO transactions_fts (transactions_fts, rank) VALUES ('integrity-check', 1)")